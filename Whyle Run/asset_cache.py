@@ -0,0 +1,62 @@
+from hashlib import sha1
+from os import listdir, makedirs, remove, replace
+from os.path import basename, isfile, join
+import struct
+import pygame
+
+# Stores already scaled sprites as raw RGBA pixels, named after the source file's hash and every
+# size it was scaled to, so a later start at the same resolution skips PNG decoding and scaling
+class AssetCache:
+	MAGIC = b"WRSP"
+	VERSION = 1
+	HEADER = struct.Struct("<4sHII")
+
+	def __init__(self, directory="./cache/"):
+		self.directory = directory
+		self.hashes = {}
+		makedirs(self.directory, exist_ok=True)
+
+	def source_hash(self, src):
+		if src not in self.hashes:
+			with open(src, "rb") as file:
+				self.hashes[src] = sha1(file.read()).hexdigest()[:16]
+		return self.hashes[src]
+
+	def get_location(self, src, sizes):
+		size_key = "_".join(f"{width:g}x{height:g}" for width, height in sizes)
+		return join(self.directory, f"{basename(src)}-{self.source_hash(src)}-{size_key}-rgba.bin")
+
+	# Returns the cached surface without converting it, so it can be read off the main thread
+	def read(self, src, sizes):
+		location = self.get_location(src, sizes)
+		if not isfile(location):
+			return None
+		with open(location, "rb") as file:
+			data = file.read()
+		magic, version, width, height = self.HEADER.unpack_from(data, 0)
+		if magic != self.MAGIC or version != self.VERSION or len(data) != self.HEADER.size + width * height * 4:
+			return None
+		return pygame.image.frombytes(data[self.HEADER.size:], (width, height), "RGBA")
+
+	def load(self, src, sizes):
+		surface = self.read(src, sizes)
+		if surface != None:
+			surface = surface.convert_alpha()
+		return surface
+
+	# Writes through a temporary file so an interrupted start never leaves a truncated entry behind
+	def save(self, src, sizes, surface):
+		location = self.get_location(src, sizes)
+		with open(location + ".tmp", "wb") as file:
+			file.write(self.HEADER.pack(self.MAGIC, self.VERSION, surface.get_width(), surface.get_height()))
+			file.write(pygame.image.tobytes(surface, "RGBA"))
+		replace(location + ".tmp", location)
+		self.remove_stale(src)
+
+	# Entries made from an older version of the source file can never be hit again
+	def remove_stale(self, src):
+		prefix = f"{basename(src)}-"
+		current = f"{prefix}{self.source_hash(src)}-"
+		for file in listdir(self.directory):
+			if file.startswith(prefix) and not file.startswith(current) and file[len(prefix):].count("-") == 2:
+				remove(join(self.directory, file))
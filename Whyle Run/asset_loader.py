@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from os import cpu_count
+from time import perf_counter
+import pygame
+
+# Scales a sprite to the given width; sprites that aren't square keep their aspect ratio
+def scale_sprite(surface, dimensions):
+	width, height = dimensions
+	if surface.get_width() != surface.get_height():
+		width, height = int(width), int(round(width / surface.get_width() * surface.get_height()))
+	return pygame.transform.scale(surface, (width, height))
+
+# Reads, decodes and scales sprites on a pool of worker threads; only the final convert_alpha,
+# which needs the display, runs on the calling thread
+class AssetLoader:
+	def __init__(self, cache=None, workers=None):
+		self.cache = cache
+		self.workers = workers or min(8, cpu_count() or 1)
+		self.timings = {}
+
+	def prepare(self, src, sizes):
+		timings = {}
+		start = perf_counter()
+		if self.cache != None:
+			surface = self.cache.read(src, sizes)
+			if surface != None:
+				timings["cache"] = perf_counter() - start
+				return surface, timings
+		with open(src, "rb") as file:
+			data = file.read()
+		timings["read"] = perf_counter() - start
+		start = perf_counter()
+		surface = pygame.image.load(BytesIO(data), src)
+		timings["decode"] = perf_counter() - start
+		start = perf_counter()
+		for dimensions in sizes:
+			surface = scale_sprite(surface, dimensions)
+		timings["scale"] = perf_counter() - start
+		if self.cache != None:
+			self.cache.save(src, sizes, surface)
+		return surface, timings
+
+	# Takes {name: (file location, [sizes to scale to in order])} and returns {name: surface}
+	def load(self, jobs):
+		surfaces = {}
+		self.timings = {}
+		with ThreadPoolExecutor(self.workers) as pool:
+			futures = {name: pool.submit(self.prepare, src, sizes) for name, (src, sizes) in jobs.items()}
+			for name, future in futures.items():
+				surface, timings = future.result()
+				start = perf_counter()
+				surfaces[name] = surface.convert_alpha()
+				timings["convert"] = perf_counter() - start
+				self.timings[name] = timings
+		return surfaces
+
+	def get_total(self, name):
+		return sum(self.timings[name].values())
+
+	def report(self, count=3):
+		slowest = sorted(self.timings, key=self.get_total, reverse=True)[:count]
+		total = sum(self.get_total(name) for name in self.timings)
+		details = ", ".join(f"{name} {self.get_total(name) * 1000:.1f} ms" for name in slowest)
+		print(f"Loaded {len(self.timings)} images on {self.workers} threads ({total * 1000:.1f} ms of work), slowest: {details}")
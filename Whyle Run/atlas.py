@@ -0,0 +1,46 @@
+import pygame
+
+# Packs many small sprites into a few large surfaces so that drawing blits sub-rectangles of one shared surface
+class TextureAtlas:
+	def __init__(self, max_size=2048, padding=1):
+		self.max_size = max_size
+		self.padding = padding
+		self.pages = []
+		self.regions = {}
+
+	# Shelf packing: sprites go left to right in rows, tallest first, starting a new page once a page is full
+	def build(self, surfaces):
+		self.pages = []
+		self.regions = {}
+		keys = sorted(surfaces, key=lambda key: (surfaces[key].get_height(), surfaces[key].get_width()), reverse=True)
+		placements = []
+		page_sizes = []
+		x = y = shelf_height = 0
+		page = -1
+		for key in keys:
+			width, height = surfaces[key].get_size()
+			if page == -1 or x + width > self.max_size:
+				x = 0
+				y += shelf_height
+				shelf_height = 0
+			if page == -1 or y + height > self.max_size:
+				page += 1
+				page_sizes.append([0, 0])
+				x = y = shelf_height = 0
+			placements.append((key, page, x, y))
+			page_sizes[page] = [max(page_sizes[page][0], x + width), max(page_sizes[page][1], y + height)]
+			shelf_height = max(shelf_height, height + self.padding)
+			x += width + self.padding
+		for width, height in page_sizes:
+			self.pages.append(pygame.Surface((max(1, width), max(1, height)), pygame.SRCALPHA).convert_alpha())
+		for key, page, x, y in placements:
+			# The pages start fully transparent, so taking the maximum copies the sprite's pixels exactly
+			self.pages[page].blit(surfaces[key], (x, y), special_flags=pygame.BLEND_RGBA_MAX)
+			self.regions[key] = (self.pages[page], pygame.Rect(x, y, surfaces[key].get_width(), surfaces[key].get_height()))
+
+	def has_region(self, key):
+		return key in self.regions
+
+	# Returns the page surface holding the sprite and the sprite's rectangle on it
+	def get_region(self, key):
+		return self.regions[key]
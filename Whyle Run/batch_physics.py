@@ -0,0 +1,161 @@
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# NumPy is optional; without it every rigidbody goes through the per-object physics in main.py
+has_numpy = numpy != None
+
+# Keeps the position, velocity, size, mass and grounded flag of many rigidbodies in arrays, one row per
+# game object, and steps all of them at once against a dense grid of the collidable tiles
+class BatchPhysics:
+	def __init__(self, capacity=64):
+		self.objects = []
+		self.count = 0
+		self.positions = numpy.zeros((capacity, 2))
+		self.previous = numpy.zeros((capacity, 2))
+		self.velocities = numpy.zeros((capacity, 2))
+		self.sizes = numpy.zeros((capacity, 2))
+		self.masses = numpy.zeros(capacity)
+		self.grounded = numpy.zeros(capacity, dtype=bool)
+		self.solid = numpy.zeros((0, 0), dtype=bool)
+		self.origin = numpy.zeros(2, dtype=int)
+		self.grid = None
+		self.grid_version = -1
+
+	def grow(self):
+		for name in ["positions", "previous", "velocities", "sizes", "masses", "grounded"]:
+			old = getattr(self, name)
+			new = numpy.zeros((len(old) * 2,) + old.shape[1:], dtype=old.dtype)
+			new[:self.count] = old[:self.count]
+			setattr(self, name, new)
+
+	def add(self, game_object):
+		if self.count == len(self.masses):
+			self.grow()
+		i = self.count
+		rigidbody = game_object.rigidbody
+		self.positions[i] = (game_object.position.x, game_object.position.y)
+		self.previous[i] = self.positions[i]
+		self.velocities[i] = (rigidbody.velocity.x, rigidbody.velocity.y)
+		self.sizes[i] = (game_object.dimensions.x, game_object.dimensions.y)
+		self.masses[i] = rigidbody.mass
+		self.grounded[i] = rigidbody.grounded
+		self.objects.append(game_object)
+		self.count += 1
+
+	# Moves the last row into the removed one so the arrays stay packed
+	def remove(self, game_object):
+		if game_object not in self.objects:
+			return
+		i = self.objects.index(game_object)
+		last = self.count - 1
+		for array in [self.positions, self.previous, self.velocities, self.sizes, self.masses, self.grounded]:
+			array[i] = array[last]
+		self.objects[i] = self.objects[last]
+		self.objects.pop()
+		self.count -= 1
+
+	# Rebuilt only when chunks have streamed in or out of the collision grid since the last step
+	def update_solids(self, collision_grid):
+		if collision_grid is self.grid and collision_grid.version == self.grid_version:
+			return
+		self.grid = collision_grid
+		self.grid_version = collision_grid.version
+		if len(collision_grid.cells) == 0:
+			self.solid = numpy.zeros((0, 0), dtype=bool)
+			self.origin = numpy.zeros(2, dtype=int)
+			return
+		tiles = numpy.array(list(collision_grid.cells), dtype=int)
+		self.origin = tiles.min(axis=0)
+		width, height = tiles.max(axis=0) - self.origin + 1
+		self.solid = numpy.zeros((height, width), dtype=bool)
+		self.solid[tiles[:, 1] - self.origin[1], tiles[:, 0] - self.origin[0]] = True
+
+	def is_loaded(self, columns):
+		x = columns - self.origin[0]
+		return (x >= 0) & (x < self.solid.shape[1])
+
+	# The same test as Camera.visible, so a body moves exactly when the per-object physics would move it
+	def is_visible(self, camera):
+		left = camera.position.x - camera.margin
+		top = camera.position.y - camera.margin
+		right = left + camera.dimensions.x + camera.margin * 2
+		bottom = top + camera.dimensions.y + camera.margin * 2
+		positions = self.positions[:self.count]
+		sizes = self.sizes[:self.count]
+		return ~((right <= positions[:, 0]) | (left > positions[:, 0] + sizes[:, 0]) | (bottom <= positions[:, 1]) | (top > positions[:, 1] + sizes[:, 1]))
+
+	# Looks up arrays of tile coordinates at once; tiles outside the loaded area count as empty
+	def is_solid(self, columns, rows):
+		y = rows - self.origin[1]
+		inside = self.is_loaded(columns) & (y >= 0) & (y < self.solid.shape[0])
+		result = numpy.zeros(len(columns), dtype=bool)
+		result[inside] = self.solid[rows[inside] - self.origin[1], columns[inside] - self.origin[0]]
+		return result
+
+	# For each body, whether any tile from start to end (inclusive) along the row or column is solid
+	def any_solid(self, start, end, fixed, along_row):
+		hit = numpy.zeros(len(start), dtype=bool)
+		for offset in range(int((end - start).max(initial=0)) + 1):
+			moving = start + offset
+			if along_row:
+				hit |= (moving <= end) & self.is_solid(moving, fixed)
+			else:
+				hit |= (moving <= end) & self.is_solid(fixed, moving)
+		return hit
+
+	# One fixed step: gravity, vertical movement and landing, then horizontal movement stopped by walls.
+	# Bodies outside the camera's view stay where they are, like off-screen objects in the per-object physics
+	def step(self, delta_time, square_size, collision_grid, camera):
+		if self.count == 0:
+			return
+		self.update_solids(collision_grid)
+		positions = self.positions[:self.count]
+		velocities = self.velocities[:self.count]
+		sizes = self.sizes[:self.count]
+		self.previous[:self.count] = positions
+		active = self.is_visible(camera)
+
+		velocities[:, 1] += numpy.where(active, self.masses[:self.count] * delta_time, 0)
+		positions[:, 1] += numpy.where(active, velocities[:, 1] * delta_time, 0)
+		left = numpy.floor(positions[:, 0] / square_size).astype(int)
+		right = numpy.floor((positions[:, 0] + sizes[:, 0] - 1e-6) / square_size).astype(int)
+		top = numpy.floor(positions[:, 1] / square_size).astype(int)
+		bottom = numpy.floor((positions[:, 1] + sizes[:, 1] - 1e-6) / square_size).astype(int)
+		falling = velocities[:, 1] >= 0
+		landed = active & falling & self.any_solid(left, right, bottom, True)
+		bumped = active & ~falling & self.any_solid(left, right, top, True)
+		positions[landed, 1] = bottom[landed] * square_size - sizes[landed, 1]
+		positions[bumped, 1] = (top[bumped] + 1) * square_size
+		velocities[landed | bumped, 1] = 0
+		self.grounded[:self.count] = numpy.where(active, landed, self.grounded[:self.count])
+
+		# Rows are measured again after landing, so the ground under a body doesn't count as a wall
+		top = numpy.floor(positions[:, 1] / square_size).astype(int)
+		bottom = numpy.floor((positions[:, 1] + sizes[:, 1] - 1e-6) / square_size).astype(int)
+		target = positions[:, 0] + velocities[:, 0]
+		moving_right = velocities[:, 0] > 0
+		column = numpy.where(moving_right, numpy.floor((target + sizes[:, 0] - 1e-6) / square_size), numpy.floor(target / square_size)).astype(int)
+		blocked = active & (velocities[:, 0] != 0) & self.any_solid(top, bottom, column, False)
+		positions[:, 0] = numpy.where(active & ~blocked, target, positions[:, 0])
+		positions[blocked & moving_right, 0] = column[blocked & moving_right] * square_size - sizes[blocked & moving_right, 0] - 0.01
+		positions[blocked & ~moving_right, 0] = (column[blocked & ~moving_right] + 1) * square_size
+		velocities[blocked, 0] = 0
+
+	# Copies the arrays back onto the game objects, once per frame rather than once per step. Columns are
+	# converted one at a time, since a list of floats doesn't make the garbage collector run like many small lists do
+	def write_back(self):
+		x, y = self.positions[:self.count, 0].tolist(), self.positions[:self.count, 1].tolist()
+		previous_x, previous_y = self.previous[:self.count, 0].tolist(), self.previous[:self.count, 1].tolist()
+		velocity_x, velocity_y = self.velocities[:self.count, 0].tolist(), self.velocities[:self.count, 1].tolist()
+		grounded = self.grounded[:self.count].tolist()
+		for i in range(self.count):
+			game_object = self.objects[i]
+			game_object.position.x = x[i]
+			game_object.position.y = y[i]
+			game_object.previous_position.x = previous_x[i]
+			game_object.previous_position.y = previous_y[i]
+			game_object.rigidbody.velocity.x = velocity_x[i]
+			game_object.rigidbody.velocity.y = velocity_y[i]
+			game_object.rigidbody.grounded = grounded[i]
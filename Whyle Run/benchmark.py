@@ -0,0 +1,137 @@
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from os import environ, listdir
+from os.path import splitext
+from time import perf_counter
+import json
+import platform
+import sys
+
+# The dummy drivers let the game run without a window or sound card, e.g. on a CI box
+environ.setdefault("SDL_VIDEODRIVER", "dummy")
+environ.setdefault("SDL_AUDIODRIVER", "dummy")
+environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+# main.py reports its dependency check on stdout, which is reserved for the results
+with redirect_stdout(sys.stderr):
+	import pygame
+	from main import Game, GameObject, Rigidbody, Vector2
+	from profiler import FrameProfiler
+
+# Each step holds the keys for a number of frames: walk right, jump, walk back left, jump, stand still
+SCRIPT = [("d", 120), ("dw", 30), ("a", 120), ("aw", 30), ("", 60)]
+
+def percentile(values, fraction):
+	if len(values) == 0:
+		return 0
+	ordered = sorted(values)
+	return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def summarize(values):
+	return {
+		"p50": round(percentile(values, 0.5) * 1000, 4),
+		"p95": round(percentile(values, 0.95) * 1000, 4),
+		"p99": round(percentile(values, 0.99) * 1000, 4),
+		"mean": round(sum(values) / max(1, len(values)) * 1000, 4),
+	}
+
+def scripted_keys(frame):
+	frame = frame % sum(length for keys, length in SCRIPT)
+	for keys, length in SCRIPT:
+		if frame < length:
+			return keys
+		frame -= length
+	return ""
+
+# Posts key events so the scripted input goes through the same event phase as real input
+def press_keys(held, keys):
+	for key in "wasd":
+		if key in keys and key not in held:
+			pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=pygame.key.key_code(key)))
+		elif key in held and key not in keys:
+			pygame.event.post(pygame.event.Event(pygame.KEYUP, key=pygame.key.key_code(key)))
+	return keys
+
+# Drops rows of extra rigidbodies above the player's spawn point
+def spawn_crowd(game, count):
+	crowd = []
+	for i in range(count):
+		position = Vector2(game.player.position.x + (i % 40 - 20) * game.square_size * 0.5, game.player.position.y - (i // 40) * game.square_size)
+		game_object = GameObject(f"Crowd {i}", position, "whyle")
+		game_object.add_component(Rigidbody(game.screen_height))
+		game.add_game_object(game_object)
+		crowd.append(game_object)
+	return crowd
+
+def run_level(game, level_name, frames, warmup, crowd_size):
+	game.keys = {}
+	game.load(level_name, False)
+	# Skip the fade in so every measured frame is gameplay
+	game.loading = False
+	crowd = spawn_crowd(game, crowd_size)
+	held = ""
+	for frame in range(warmup):
+		held = press_keys(held, scripted_keys(frame))
+		game.run_frame()
+	# A profiler big enough to hold every measured frame, so the percentiles cover the whole run
+	game.profiler = FrameProfiler(game.profiler.stage_names, frames)
+	frame_times = []
+	for frame in range(warmup, warmup + frames):
+		held = press_keys(held, scripted_keys(frame))
+		frame_start = perf_counter()
+		game.run_frame()
+		frame_times.append(perf_counter() - frame_start)
+	phases = {name: summarize(buffer.get_values()) for name, buffer in game.profiler.stages.items()}
+	for game_object in crowd:
+		game.remove_game_object(game_object)
+	return {"frames": frames, "frame": summarize(frame_times), "phases": phases}
+
+def main():
+	parser = ArgumentParser(description="Plays every level headlessly and reports frame times in milliseconds as JSON.")
+	parser.add_argument("--frames", type=int, default=600)
+	parser.add_argument("--warmup", type=int, default=60)
+	parser.add_argument("--levels", nargs="*", help="level names to run, defaults to every level in levels/")
+	parser.add_argument("--output", help="file to write the results to instead of stdout")
+	parser.add_argument("--dirty-rects", action="store_true", help="use the dirty rectangle renderer instead of flipping the whole window")
+	parser.add_argument("--render-scale", type=float, default=1, help="internal resolution as a fraction of the window size")
+	parser.add_argument("--smooth", action="store_true", help="use smooth instead of nearest neighbour scaling to the window")
+	parser.add_argument("--deterministic", action="store_true", help="take exactly one fixed physics step per frame instead of following the wall clock")
+	parser.add_argument("--crowd", type=int, default=0, help="number of extra rigidbodies to drop into each level")
+	parser.add_argument("--batch-physics", action="store_true", help="step the extra rigidbodies together with NumPy")
+	args = parser.parse_args()
+	levels = args.levels
+	if not levels:
+		levels = sorted({splitext(f)[0] for f in listdir("./levels/") if f.endswith(".json") or f.endswith(".lvl")})
+	game = Game()
+	game.fps_cap = 0
+	game.deterministic = args.deterministic
+	game.dirty_rendering = args.dirty_rects
+	game.render_scale = args.render_scale
+	if args.smooth:
+		game.scale_filter = "smooth"
+	if args.batch_physics:
+		with redirect_stdout(sys.stderr):
+			game.enable_batch_physics()
+	with redirect_stdout(sys.stderr):
+		game.setup()
+	results = {
+		"python": platform.python_version(),
+		"pygame": pygame.version.ver,
+		"resolution": [game.screen_width, game.screen_height],
+		"crowd": args.crowd,
+		"batch physics": game.batch_physics != None,
+		"assets": {name: round(game.asset_loader.get_total(name) * 1000, 4) for name in game.asset_loader.timings},
+		"levels": {},
+	}
+	for level_name in levels:
+		results["levels"][level_name] = run_level(game, level_name, args.frames, args.warmup, args.crowd)
+	pygame.quit()
+	output = json.dumps(results, indent=4)
+	if args.output:
+		with open(args.output, "w") as file:
+			file.write(output)
+	else:
+		print(output)
+
+if __name__ == "__main__":
+	main()
@@ -1,10 +1,17 @@
 from subprocess import run
 from sys import executable
 from pkg_resources import working_set
-from time import time
+from time import time, perf_counter
+from collections import deque
+from queue import Queue
+from threading import Thread
 import json
-from os import listdir
+from os import listdir, makedirs
 from os.path import isfile, join
+from asset_cache import AssetCache
+from asset_loader import AssetLoader, scale_sprite
+from level_format import BinaryLevel, convert, read_json_layers, update_binary, write_json
+from profiler import FrameProfiler
 
 print("Loading libraries. . . Please wait")
 
@@ -37,18 +44,34 @@ class Event:
 		self.trigger_key = trigger_key
 
 class Image:
-	def __init__(self, src, draw_width=64, draw_height=64):
+	# An image that was already loaded and scaled elsewhere can be passed in along with the sizes it was scaled to
+	def __init__(self, src, draw_width=64, draw_height=64, cache=None, image=None, sizes=None):
 		self.src = src
-		self.image = pygame.image.load(self.src).convert_alpha()
-		self.rescale(Vector2(draw_width, draw_height))
+		self.cache = cache
+		self.sizes = []
+		self.image = None
+		if image != None:
+			self.image = image
+			self.sizes = list(sizes)
+			self.dimensions = Vector2(self.image.get_width(), self.image.get_height())
+		else:
+			self.rescale(Vector2(draw_width, draw_height))
 		self.image_rect = self.image.get_rect()
 
+	# Every rescale works from the previous result, so cache entries are keyed by the whole chain of sizes
 	def rescale(self, new_dimensions):
-		if self.image.get_width() != self.image.get_height():
-			x = new_dimensions.x
-			y = x
-			new_dimensions = Vector2(int(new_dimensions.x), int(round(new_dimensions.x / self.image.get_width() * self.image.get_height())))
-		self.image = pygame.transform.scale(self.image, (new_dimensions.x, new_dimensions.y)).convert_alpha()
+		self.sizes.append((new_dimensions.x, new_dimensions.y))
+		cached = None
+		if self.cache != None:
+			cached = self.cache.load(self.src, self.sizes)
+		if cached != None:
+			self.image = cached
+		else:
+			if self.image == None:
+				self.image = pygame.image.load(self.src).convert_alpha()
+			self.image = scale_sprite(self.image, (new_dimensions.x, new_dimensions.y)).convert_alpha()
+			if self.cache != None:
+				self.cache.save(self.src, self.sizes, self.image)
 		self.dimensions = Vector2(self.image.get_width(), self.image.get_height())
 
 	def draw(self, screen, position):
@@ -160,15 +183,87 @@ class Layer:
 	def __init__(self, name, layer_index):
 		self.name = name
 		self.layer_index = layer_index
-		self.blocks = []
+		# Blocks keyed by their (x, y) tile, so finding the block at a tile doesn't scan the whole layer
+		self.blocks = {}
 	def add_block(self, block):
-		self.blocks.append(block)
+		self.blocks[(block.position.x, block.position.y)] = block
+
+	def get_block(self, x, y):
+		return self.blocks.get((x, y), False)
+
+	def remove_block(self, x, y):
+		return self.blocks.pop((x, y), False)
+
+	def get_blocks(self):
+		return self.blocks.values()
+
+	# Yields the blocks inside the rectangle row by row, looking up each tile instead of walking the whole layer
+	def query(self, left, top, right, bottom):
+		for y in range(top, bottom):
+			for x in range(left, right):
+				block = self.blocks.get((x, y))
+				if block != None:
+					yield block
+
+	def clear(self):
+		self.blocks = {}
+
+# The changed tiles of one edit, each stored once as its (name, collidable) state before and after, or None when empty
+class Edit:
+	def __init__(self, layer_index):
+		self.layer_index = layer_index
+		self.changes = {}
+
+	def record(self, x, y, before, after):
+		if (x, y) in self.changes:
+			before = self.changes[(x, y)][0]
+		elif before == after:
+			return
+		self.changes[(x, y)] = (before, after)
+
+	def get_size(self):
+		return len(self.changes)
+
+# Undo and redo stacks of edits; the oldest edits are dropped once too many edits or changed tiles are kept
+class History:
+	def __init__(self, max_edits=200, max_tiles=100000):
+		self.max_edits = max_edits
+		self.max_tiles = max_tiles
+		self.undo_stack = deque()
+		self.redo_stack = []
+		self.tiles = 0
+
+	def push(self, edit):
+		if edit.get_size() == 0:
+			return
+		self.undo_stack.append(edit)
+		self.tiles += edit.get_size()
+		self.redo_stack = []
+		while len(self.undo_stack) > self.max_edits or (self.tiles > self.max_tiles and len(self.undo_stack) > 1):
+			self.tiles -= self.undo_stack.popleft().get_size()
+
+	def undo(self):
+		if len(self.undo_stack) == 0:
+			return None
+		edit = self.undo_stack.pop()
+		self.tiles -= edit.get_size()
+		self.redo_stack.append(edit)
+		return edit
+
+	def redo(self):
+		if len(self.redo_stack) == 0:
+			return None
+		edit = self.redo_stack.pop()
+		self.undo_stack.append(edit)
+		self.tiles += edit.get_size()
+		return edit
 
 
 class Game:
 	def __init__(self):
 		self.fps_cap = 60
-		self.times = []
+		self.profiler = FrameProfiler(["input", "tiles", "ui", "flip"])
+		self.show_profiler = False
 		self.tested_resolution = 0
 		self.delta_time = 0
 		self.images = {}
@@ -195,6 +290,18 @@ class Game:
 		self.fill = False
 		self.filling = False
 		self.fill_start = Vector2()
+		self.history = History()
+		self.edit = None
+		self.clipboard = []
+		self.tool = "brush"
+		self.bucket_limit = 20000
+		# Bumped on every change; a file is only written again if the level changed since it was last saved there
+		self.revision = 0
+		self.saved_revisions = {}
+		self.autosave_interval = 30
+		self.last_autosave = time()
+		self.save_queue = Queue()
+		self.save_thread = Thread(target=self.save_worker, daemon=True)
 		self.optioning = False
 		self.layers = []
 		self.current_layer_index = 0
@@ -202,23 +309,37 @@ class Game:
 		self.keys = {"w":False,"a":False,"s":False,"d":False}
 		self.offset = Vector2()
 		self.font_size = 25
-
-	def draw_text(self, text="", position=Vector2(), color=(0,0,0), center=False, text_shadow=True):
+		self.grid = None
+		self.panel = None
+		self.panel_key = None
+		self.panel_position = (0, 0)
+
+	def draw_text(self, text="", position=Vector2(), color=(0,0,0), center=False, text_shadow=True, surface=None):
+		if surface == None:
+			surface = self.screen
 		if center:
 			w, h = self.font.size(text)
 			position = Vector2(position.x - w * 0.5, position.y - h * 0.5)
 		if text_shadow:
 			text_surface = self.font.render(text, True, (0,0,0))
-			self.screen.blit(text_surface, (position.x + 2, position.y + 2))
+			surface.blit(text_surface, (position.x + 2, position.y + 2))
 		text_surface = self.font.render(text, True, color)
-		self.screen.blit(text_surface, (position.x, position.y))
+		surface.blit(text_surface, (position.x, position.y))
 
 	def load_images(self):
+		self.asset_cache = AssetCache()
+		self.asset_loader = AssetLoader(self.asset_cache)
 		files = [f for f in listdir("./images/") if isfile(join("./images/", f))]
+		jobs = {}
 		for file in files:
 			if ".png" in file:
-				self.block_types[file.split(".")[0]] = Image(f"./images/{file}", self.square_size, self.square_size)
-		self.block_types["principal"].rescale(Vector2(self.square_size * 1.25, 32))
+				sizes = [(self.square_size, self.square_size)]
+				if file.split(".")[0] == "principal":
+					sizes.append((self.square_size * 1.25, 32))
+				jobs[file.split(".")[0]] = (f"./images/{file}", sizes)
+		for name, surface in self.asset_loader.load(jobs).items():
+			self.block_types[name] = Image(jobs[name][0], cache=self.asset_cache, image=surface, sizes=jobs[name][1])
+		self.asset_loader.report()
 
 	def add_layer(self, layer_name):
 		self.layers.append(Layer(layer_name, self.layer_ind))
@@ -264,6 +385,7 @@ class Game:
 		self.screen_width = int(pygame.display.Info().current_w * 0.75)
 		self.extra_width = int(pygame.display.Info().current_w * 0.2)
 		self.square_size = int(round(self.screen_width / self.square_width))
+		self.view_height = -(-self.screen_height // self.square_size)
 		self.screen = pygame.display.set_mode((self.screen_width + self.extra_width, self.screen_height))
 		self.add_layer("base")
 		self.add_layer("decorations")
@@ -280,10 +402,12 @@ class Game:
 		main_screen.add_keybind(KeyBind("removing", "Remove", "R", self.removing, self.toggle_removing))
 		main_screen.add_keybind(KeyBind("show grid", "Show Grid", "G", self.show_grid, self.toggle_grid))
 		main_screen.add_keybind(KeyBind("fill", "Fill Scene", "F", self.fill, self.toggle_fill))
+		main_screen.add_keybind(KeyBind("tool", "Tool", "B", self.tool, self.toggle_tool))
 		self.settings.append(main_screen)
 		scene_manager = Setting("scene manager", self.screen_height, self.screen_width, self.extra_width)
 		scene_manager.add_button(Button("Back", self.back))
-		scene_manager.add_input(Input("level1", "level name"))
+		self.level_name = Input("level1", "level name")
+		scene_manager.add_input(self.level_name)
 		scene_manager.add_button(Button("Load Scene", self.load))
 		scene_manager.add_button(Button("Save Scene", self.save))
 		self.settings.append(scene_manager)
@@ -297,9 +421,13 @@ class Game:
 		self.settings.append(add_event)
 		self.set_settings("main")
 		self.load_images()
+		self.build_grid()
+		makedirs("./autosave/", exist_ok=True)
+		self.save_thread.start()
 		exit_loop = False
 		while True:
 			self.manage_time()
+			phase_start = perf_counter()
 			self.screen.fill((32,32,32))
 			for event in pygame.event.get():
 				if event.type == pygame.QUIT:
@@ -309,23 +437,28 @@ class Game:
 					self.manage_event(event)
 			if exit_loop:
 				break
+			self.autosave()
+			phase_start = self.record_phase("input", phase_start)
 
 			if self.show_grid:
-				for x in range(self.square_width):
-					for y in range(self.square_height):
-						pygame.draw.rect(self.screen, (255, 0, 0), (x*self.square_size,y*self.square_size,self.square_size,self.square_size), 3)
+				self.screen.blit(self.grid, (0, 0))
 			mouse_position = pygame.mouse.get_pos()
 			x = int(mouse_position[0] / self.square_size) * self.square_size
 			y = int(mouse_position[1] / self.square_size) * self.square_size
+			# One row above the view is included for sprites taller than a tile
 			for layer in self.layers:
-				for block in layer.blocks:
-					if self.square_width > (block.position.x - self.offset.x):
-						self.block_types[block.name].draw(self.screen, Vector2((block.position.x - self.offset.x) * self.square_size, (block.position.y - self.offset.y) * self.square_size))
+				for block in layer.query(self.offset.x, self.offset.y - 1, self.offset.x + self.square_width, self.offset.y + self.view_height):
+					self.block_types[block.name].draw(self.screen, Vector2((block.position.x - self.offset.x) * self.square_size, (block.position.y - self.offset.y) * self.square_size))
 			for event in self.events:
-				self.block_types["event"].draw(self.screen, Vector2(event.position.x * self.square_size, event.position.y * self.square_size))
+				size = float(event.radius) if self.show_event_radius else 0
+				if not self.in_view(event.position, size + 1):
+					continue
+				event_x = (event.position.x - self.offset.x) * self.square_size
+				event_y = (event.position.y - self.offset.y) * self.square_size
+				self.block_types["event"].draw(self.screen, Vector2(event_x, event_y))
 				if self.show_event_radius:
-					size = float(event.radius)
-					pygame.draw.circle(self.screen, (0, 0, 255), (event.position.x * self.square_size + self.square_size * 0.5, event.position.y * self.square_size + self.square_size * 0.5), self.square_size * size, width=2)
+					pygame.draw.circle(self.screen, (0, 0, 255), (event_x + self.square_size * 0.5, event_y + self.square_size * 0.5), self.square_size * size, width=2)
+			phase_start = self.record_phase("tiles", phase_start)
 			if self.get_setting() == "main":
 				self.block_name = self.get_input("block name").text
 			if mouse_position[0] < self.screen_width:
@@ -334,25 +467,19 @@ class Game:
 						if not self.removing:
 							self.block_types[self.block_name].draw(self.screen, Vector2(x, y))
 							if self.filling:
-								start_x = self.fill_start.x
-								end_x = int(mouse_position[0] / self.square_size)
-								start_y = self.fill_start.y
-								end_y = int(mouse_position[1] / self.square_size)
-								if start_x > end_x:
-									new_var = start_x
-									start_x = end_x
-									end_x = new_var
-								if start_y > end_y:
-									new_var = start_y
-									start_y = end_y
-									end_y = new_var
+								start_x, start_y, end_x, end_y = self.get_selection(mouse_position)
 								for x in range(start_x, end_x + 1):
 									for y in range(start_y, end_y + 1):
-										self.block_types[self.block_name].draw(self.screen, Vector2(x * self.square_size, y * self.square_size))
+										self.block_types[self.block_name].draw(self.screen, Vector2((x - self.offset.x) * self.square_size, (y - self.offset.y) * self.square_size))
 						if self.mouse_down:
 							x = int(mouse_position[0] / self.square_size) + self.offset.x
 							y = int(mouse_position[1] / self.square_size) + self.offset.y
-							if not self.fill:
+							if self.tool == "bucket":
+								self.bucket_fill(x, y)
+								# One fill per click, not one per frame the button is held
+								self.mouse_down = False
+							elif not self.fill:
+								self.begin_edit()
 								if self.removing:
 									if not self.remove_event(x, y):
 										self.remove_block(x, y)
@@ -364,33 +491,17 @@ class Game:
 									self.filling = True
 								else:
 									self.filling = False
-									start_x = self.fill_start.x
-									end_x = int(mouse_position[0] / self.square_size)
-									start_y = self.fill_start.y
-									end_y = int(mouse_position[1] / self.square_size)
-									if start_x > end_x:
-										new_var = start_x
-										start_x = end_x
-										end_x = new_var
-									if start_y > end_y:
-										new_var = start_y
-										start_y = end_y
-										end_y = new_var
-									for x in range(start_x, end_x + 1):
-										for y in range(start_y, end_y + 1):
-											if self.removing:
-												self.remove_block(x, y)
-											else:
-												self.set_block(x, y)
-												#self.block_types[self.block_name].draw(self.screen, Vector2(x * self.square_size, y * self.square_size))
+									if self.removing:
+										self.clear_region(*self.get_selection(mouse_position))
+									else:
+										self.fill_region(*self.get_selection(mouse_position))
 				else:
 					self.block_types["event"].draw(self.screen, Vector2(x, y))
 					if self.show_event_radius:
 						size = float(self.get_input("event radius").text)
 						pygame.draw.circle(self.screen, (0, 0, 255), (x + self.square_size * 0.5, y + self.square_size * 0.5), self.square_size * size, width=2)
 					found = False
-					x = int(mouse_position[0] / self.square_size)
-					y = int(mouse_position[1] / self.square_size)
+					x, y = self.get_mouse_tile(mouse_position)
 					if self.mouse_down:
 						for event in self.events:
 							if event.position.x == x and event.position.y == y:
@@ -398,12 +509,12 @@ class Game:
 								break
 						if not found:
 							self.events.append(Event(self.get_input("event name").text, Vector2(x,y), self.get_input("event radius").text, self.get_input("trigger key").text))
+							self.revision += 1
 			for button in self.buttons:
 				if self.mouse_down:
 					if box_collides(Vector2(mouse_position[0], mouse_position[1]), Vector2(button.position.x - button.dimensions.x * 0.5, button.position.y - button.dimensions.y * 0.5), Vector2(1,1), button.dimensions):
 						button.click()
 						self.mouse_down = False
-				self.draw_button(button)
 			collision = False
 			for inp in self.inputs:
 				if self.mouse_down:
@@ -412,7 +523,6 @@ class Game:
 						self.optioning = False
 						self.typing_index = self.inputs.index(inp)
 						collision = True
-				self.draw_button(inp)
 			for option in self.options:
 				if self.mouse_down:
 					if box_collides(Vector2(mouse_position[0], mouse_position[1]), Vector2(option.position.x - option.dimensions.x * 0.5, option.position.y - option.dimensions.y * 0.5), Vector2(1,1), option.dimensions):
@@ -420,21 +530,36 @@ class Game:
 						self.optioning = True
 						self.typing = False
 						collision = True
-				self.draw_button(option)
-			for keybind in self.keybinds:
-				self.draw_text(keybind.get_text(), keybind.position,(255,255,255),True,True)
+			self.draw_panel()
 			if self.mouse_down and not collision:
 				self.typing = False
 				self.optioning = False
-			self.draw_text(f"FPS: {len(self.times)}", Vector2(0, 0), (45, 255, 0))
+			self.draw_text(f"FPS: {self.profiler.fps()}", Vector2(0, 0), (45, 255, 0))
+			if self.show_profiler:
+				self.profiler.draw(self.screen, Vector2(0, 40))
+			phase_start = self.record_phase("ui", phase_start)
 			pygame.display.flip()
+			self.record_phase("flip", phase_start)
 			self.clock.tick(self.fps_cap)
+		# Unsaved work goes to the autosave, and queued saves finish before the process exits
+		self.autosave(True)
+		self.save_queue.join()
 
 	def find_block(self, position):
-		for block in self.layers[self.current_layer_index].blocks:
-			if block.position.x == position.x and block.position.y == position.y:
-				return block
-		return False
+		return self.layers[self.current_layer_index].get_block(position.x, position.y)
+
+	# Returns the rectangle between the fill start and the tile under the mouse as start x, start y, end x, end y
+	def get_selection(self, mouse_position):
+		x, y = self.get_mouse_tile(mouse_position)
+		return min(self.fill_start.x, x), min(self.fill_start.y, y), max(self.fill_start.x, x), max(self.fill_start.y, y)
+
+	# Returns True if anything within margin tiles of the position is on screen
+	def in_view(self, position, margin=0):
+		return (self.offset.x - margin <= position.x < self.offset.x + self.square_width + margin and
+			self.offset.y - margin <= position.y < self.offset.y + self.view_height + margin)
+
+	def get_mouse_tile(self, mouse_position):
+		return int(mouse_position[0] / self.square_size) + self.offset.x, int(mouse_position[1] / self.square_size) + self.offset.y
 
 	def get_input(self, name):
 		for inp in self.inputs:
@@ -452,98 +577,293 @@ class Game:
 		print("Lets you add players, npcs, and other pre-made non-static items.")
 
 	def load(self):
-		file_location = f"./levels/{self.get_input('level name').text}.json"
+		file_location = f"./levels/{self.level_name.text}.json"
 		self.events = []
-		with open(file_location, "r") as file:
-			dictionary = json.load(file)
+		self.history = History()
+		self.edit = None
+		# Older levels have a single layer, so layers the file doesn't have must not keep the previous level's tiles
+		for layer in self.layers:
+			layer.clear()
+		level_location = update_binary(file_location)
+		if level_location != None:
+			level = BinaryLevel(level_location, self.square_width, self.square_height)
+			for i in range(level.layer_count):
+				for name, x, y, collidable in level.read_layer(i):
+					self.layers[i].add_block(Block(name,Vector2(x, y),collidable))
+			events = level.events
+		else:
+			with open(file_location, "r") as file:
+				dictionary = json.load(file)
 			i = 0
-			for layer in dictionary["layers"]:
-				self.layers[i].blocks = []
+			for layer in read_json_layers(dictionary):
 				for block in layer:
 					self.layers[i].add_block(Block(block["name"],Vector2(block["position"]["x"], block["position"]["y"]),block["collidable"]))
 				i += 1
-			for event in dictionary["events"]:
-				self.events.append(Event(event["name"],Vector2(event["position"]["x"], event["position"]["y"]),event["radius"],event["trigger key"]))
+			events = dictionary.get("events", [])
+		for event in events:
+			self.events.append(Event(event["name"],Vector2(event["position"]["x"], event["position"]["y"]),event["radius"],event["trigger key"]))
+		self.revision += 1
+		self.saved_revisions[file_location] = self.revision
 
 	def save(self):
-		file_location = f"./levels/{self.get_input('level name').text}.json"
-		json_file = {}
-		json_file["blocks"] = []
-		json_file["events"] = []
-		json_file["player position"] = {
-			"x": 0,
-			"y": 0
-		}
-		json_file["layers"] = []
-		for layer in self.layers:
-			json_file["layers"].append([])
-			for block in layer.blocks:
-				json_file["layers"][len(json_file["layers"]) - 1].append({
-					"name": block.name,
-					"position": {
-						"x": block.position.x,
-						"y": block.position.y
-					},
-					"collidable": block.collidable
-				})
-		for event in self.events:
-			json_file["events"].append({
-				"name": event.name,
-				"position": {
-					"x": event.position.x,
-					"y": event.position.y
-				},
-				"trigger key": event.trigger_key,
-				"radius": event.radius
-			})
-		with open(file_location, "w") as file:
-			json.dump(json_file, file, indent=4) 
-
-	def draw_button(self, button):
+		self.queue_save(f"./levels/{self.level_name.text}.json", True)
+
+	# Autosaves go to their own folder so they never overwrite a level that wasn't saved on purpose
+	def autosave(self, force=False):
+		if force or time() - self.last_autosave >= self.autosave_interval:
+			self.last_autosave = time()
+			self.queue_save(f"./autosave/{self.level_name.text}.json", False)
+
+	# Blocks are changed in place, so the saving thread gets plain tuples instead of the blocks themselves
+	def snapshot(self):
+		layers = [[(block.name, block.position.x, block.position.y, block.collidable) for block in layer.get_blocks()] for layer in self.layers]
+		events = [(event.name, event.position.x, event.position.y, event.trigger_key, event.radius) for event in self.events]
+		return layers, events
+
+	def queue_save(self, file_location, convert_level):
+		if self.saved_revisions.get(file_location) == self.revision:
+			return
+		self.saved_revisions[file_location] = self.revision
+		layers, events = self.snapshot()
+		self.save_queue.put((file_location, layers, events, convert_level))
+
+	# Builds and writes the JSON off the UI thread, so saving a big level doesn't freeze the editor
+	def save_worker(self):
+		while True:
+			file_location, layers, events, convert_level = self.save_queue.get()
+			try:
+				write_json(file_location, build_level(layers, events))
+				if convert_level:
+					convert(file_location)
+			# Anything escaping here would end the thread, so later saves would be dropped and exiting would hang
+			except Exception as error:
+				print(f"Could not save {file_location}: {error}")
+				self.saved_revisions.pop(file_location, None)
+			finally:
+				self.save_queue.task_done()
+
+	def draw_button(self, button, surface):
 		x = button.position.x - button.dimensions.x * 0.5
 		y = button.position.y - button.dimensions.y * 0.5
-		pygame.draw.rect(self.screen, (0,0,0), (x+4, y+4, button.dimensions.x, button.dimensions.y))
-		pygame.draw.rect(self.screen, button.color, (x, y, button.dimensions.x, button.dimensions.y))
-		self.draw_text(button.text, Vector2(button.position.x, button.position.y), (255, 255, 255), True, True)
+		pygame.draw.rect(surface, (0,0,0), (x+4, y+4, button.dimensions.x, button.dimensions.y))
+		pygame.draw.rect(surface, button.color, (x, y, button.dimensions.x, button.dimensions.y))
+		self.draw_text(button.text, Vector2(button.position.x, button.position.y), (255, 255, 255), True, True, surface)
 		if button.gui_type != "button":
-			self.draw_text(button.name.title() + ":", Vector2(x, button.position.y - self.screen_height * 0.07), (255, 255, 255), False, True)
+			self.draw_text(button.name.title() + ":", Vector2(x, button.position.y - self.screen_height * 0.07), (255, 255, 255), False, True, surface)
 		if button.gui_type == "option":
-			self.draw_text("<", Vector2(button.position.x - self.screen_width * 0.075, button.position.y), (255, 255, 255), True, True)
-			self.draw_text(">", Vector2(button.position.x + self.screen_width * 0.075, button.position.y), (255, 255, 255), True, True)
+			self.draw_text("<", Vector2(button.position.x - self.screen_width * 0.075, button.position.y), (255, 255, 255), True, True, surface)
+			self.draw_text(">", Vector2(button.position.x + self.screen_width * 0.075, button.position.y), (255, 255, 255), True, True, surface)
+
+	# The grid never moves, so it is drawn once and blitted every frame
+	def build_grid(self):
+		self.grid = pygame.Surface((self.square_width * self.square_size, self.square_height * self.square_size), pygame.SRCALPHA).convert_alpha()
+		for x in range(self.square_width):
+			for y in range(self.square_height):
+				pygame.draw.rect(self.grid, (255, 0, 0), (x*self.square_size,y*self.square_size,self.square_size,self.square_size), 3)
+
+	# Everything the side panel shows; the panel is only rendered again when this changes
+	def get_panel_key(self):
+		texts = [widget.text for widget in self.buttons + self.inputs + self.options]
+		return (self.get_setting(), tuple(texts), tuple(keybind.get_text() for keybind in self.keybinds))
+
+	# Renders the panel's widgets onto a transparent surface cropped to what was drawn
+	def render_panel(self):
+		surface = pygame.Surface(self.screen.get_size(), pygame.SRCALPHA)
+		for widget in self.buttons + self.inputs + self.options:
+			self.draw_button(widget, surface)
+		for keybind in self.keybinds:
+			self.draw_text(keybind.get_text(), keybind.position,(255,255,255),True,True,surface)
+		rect = surface.get_bounding_rect()
+		self.panel = surface.subsurface(rect).convert_alpha()
+		self.panel_position = rect.topleft
+
+	def draw_panel(self):
+		key = self.get_panel_key()
+		if key != self.panel_key:
+			self.render_panel()
+			self.panel_key = key
+		self.screen.blit(self.panel, self.panel_position)
 
 	def set_block(self, x, y, name=""):
 		if name == "":
 			name = self.block_name
-		found = False
-		if self.find_block(Vector2(x, y)) != False:
-			b = self.find_block(Vector2(x, y))
-			b.name = name
-			b.collidable = self.collidable
+		layer = self.layers[self.current_layer_index]
+		block = layer.get_block(x, y)
+		before = get_state(block)
+		if block != False:
+			block.name = name
+			block.collidable = self.collidable
 		else:
-			self.layers[self.current_layer_index].add_block(Block(name,Vector2(x,y),self.collidable))
+			block = Block(name,Vector2(x,y),self.collidable)
+			layer.add_block(block)
 		if name == "grass" and y > 0:
-			if self.find_block(Vector2(x,y-1)) != False:
-				self.find_block(Vector2(x, y)).name = "dirt"
-		if self.find_block(Vector2(x, y+1)) != False and self.find_block(Vector2(x, y+1)).name == "grass":
+			if layer.get_block(x, y-1) != False:
+				block.name = "dirt"
+		self.record_change(x, y, before, get_state(block))
+		below = layer.get_block(x, y+1)
+		if below != False and below.name == "grass":
 			self.set_block(x, y+1, "dirt")
 
 	def remove_block(self, x, y):
-		if self.find_block(Vector2(x, y)) != False:
-			self.layers[self.current_layer_index].blocks.remove(self.find_block(Vector2(x, y)))
+		block = self.layers[self.current_layer_index].remove_block(x, y)
+		if block != False:
+			self.record_change(x, y, get_state(block), None)
+
+	# Changes made while an edit is open are undone and redone together
+	def begin_edit(self):
+		if self.edit == None:
+			self.edit = Edit(self.current_layer_index)
+		return self.edit
+
+	def end_edit(self):
+		if self.edit != None:
+			self.history.push(self.edit)
+			self.edit = None
+
+	def record_change(self, x, y, before, after):
+		if before != after:
+			self.revision += 1
+		if self.edit != None:
+			self.edit.record(x, y, before, after)
+
+	def write_state(self, layer, x, y, state):
+		self.record_change(x, y, get_state(layer.get_block(x, y)), state)
+		set_state(layer, x, y, state)
+
+	# Gives the same result as calling set_block on every tile, applying the grass rule once per column instead
+	def fill_region(self, start_x, start_y, end_x, end_y):
+		self.begin_edit()
+		layer = self.layers[self.current_layer_index]
+		for x in range(start_x, end_x + 1):
+			for y in range(start_y, end_y + 1):
+				name = self.block_name
+				if name == "grass" and y > 0 and (y > start_y or layer.get_block(x, y-1) != False):
+					name = "dirt"
+				self.write_state(layer, x, y, (name, self.collidable))
+			y = end_y + 1
+			while layer.get_block(x, y) != False and layer.get_block(x, y).name == "grass":
+				self.write_state(layer, x, y, ("dirt", self.collidable))
+				y += 1
+		self.end_edit()
+
+	def clear_region(self, start_x, start_y, end_x, end_y):
+		self.begin_edit()
+		layer = self.layers[self.current_layer_index]
+		for x in range(start_x, end_x + 1):
+			for y in range(start_y, end_y + 1):
+				self.write_state(layer, x, y, None)
+		self.end_edit()
+
+	# Scanline flood fill: takes whole horizontal runs of matching tiles at once and only seeds the rows above
+	# and below once per run. Returns None if the region grows past the limit, e.g. an unbounded empty area
+	def find_region(self, layer, x, y, limit):
+		target = get_name(layer.get_block(x, y))
+		region = set()
+		stack = [(x, y)]
+		while len(stack) > 0:
+			x, y = stack.pop()
+			if (x, y) in region:
+				continue
+			# Empty runs have no end of their own, so the walk stops once a single run is past the limit
+			left = x
+			while x - left <= limit and (left - 1, y) not in region and get_name(layer.get_block(left - 1, y)) == target:
+				left -= 1
+			right = x
+			while right - left <= limit and (right + 1, y) not in region and get_name(layer.get_block(right + 1, y)) == target:
+				right += 1
+			for i in range(left, right + 1):
+				region.add((i, y))
+			if len(region) > limit:
+				return None
+			for row in (y - 1, y + 1):
+				i = left
+				while i <= right:
+					if (i, row) not in region and get_name(layer.get_block(i, row)) == target:
+						stack.append((i, row))
+						while i <= right and get_name(layer.get_block(i, row)) == target:
+							i += 1
+					i += 1
+		return region
+
+	# Replaces the tiles connected to (x, y) that share its block name, or empties them when removing, as one edit
+	def bucket_fill(self, x, y):
+		layer = self.layers[self.current_layer_index]
+		region = self.find_region(layer, x, y, self.bucket_limit)
+		if region == None:
+			print(f"Bucket fill stopped: the region is larger than {self.bucket_limit} tiles")
+			return
+		state = None
+		if not self.removing:
+			state = (self.block_name, self.collidable)
+		self.begin_edit()
+		for x, y in region:
+			self.write_state(layer, x, y, state)
+		self.end_edit()
+
+	# The clipboard holds the blocks of the region relative to its top left tile
+	def copy_region(self, start_x, start_y, end_x, end_y):
+		layer = self.layers[self.current_layer_index]
+		self.clipboard = []
+		for x in range(start_x, end_x + 1):
+			for y in range(start_y, end_y + 1):
+				block = layer.get_block(x, y)
+				if block != False:
+					self.clipboard.append((x - start_x, y - start_y, get_state(block)))
+
+	def paste(self, x, y):
+		self.begin_edit()
+		layer = self.layers[self.current_layer_index]
+		for dx, dy, state in self.clipboard:
+			self.write_state(layer, x + dx, y + dy, state)
+		self.end_edit()
+
+	def undo(self):
+		self.end_edit()
+		edit = self.history.undo()
+		if edit != None:
+			self.revision += 1
+			for (x, y), (before, after) in edit.changes.items():
+				set_state(self.layers[edit.layer_index], x, y, before)
+
+	def redo(self):
+		self.end_edit()
+		edit = self.history.redo()
+		if edit != None:
+			self.revision += 1
+			for (x, y), (before, after) in edit.changes.items():
+				set_state(self.layers[edit.layer_index], x, y, after)
+
+	# Ctrl shortcuts: copy, cut and paste the fill rectangle, undo and redo
+	def manage_shortcut(self, character):
+		mouse_position = pygame.mouse.get_pos()
+		if character == "z":
+			self.undo()
+		elif character == "y":
+			self.redo()
+		elif (character == "c" or character == "x") and self.filling:
+			self.filling = False
+			self.copy_region(*self.get_selection(mouse_position))
+			if character == "x":
+				self.clear_region(*self.get_selection(mouse_position))
+		elif character == "v" and mouse_position[0] < self.screen_width:
+			self.paste(*self.get_mouse_tile(mouse_position))
 
 	def remove_event(self, x, y):
 		for event in self.events:
 			if event.position.x == x and event.position.y == y:
 				self.events.remove(event)
+				self.revision += 1
 				return True
 		return False
 
 	def manage_time(self):
-		if len(self.times) > 0:
-			self.delta_time = time() - self.times[len(self.times) - 1]
-		self.times.append(time())
-		while(time() - self.times[0] > 1):
-			self.times.pop(0)
+		self.delta_time = self.profiler.tick(time())
+
+	# Stores how long a stage of the frame took, and returns the start time of the next stage
+	def record_phase(self, name, phase_start):
+		now = perf_counter()
+		self.profiler.record(name, now - phase_start)
+		return now
 
 	def toggle_collision(self):
 		self.collidable = not self.collidable
@@ -553,6 +873,11 @@ class Game:
 		self.removing = not self.removing
 		self.setting.get_keybind("removing").value = self.removing
 
+	# B switches between painting single tiles and bucket filling a region
+	def toggle_tool(self):
+		self.tool = "bucket" if self.tool == "brush" else "brush"
+		self.setting.get_keybind("tool").value = self.tool
+
 	def toggle_grid(self):
 		self.show_grid = not self.show_grid
 		self.setting.get_keybind("show grid").value = self.show_grid
@@ -571,6 +896,7 @@ class Game:
 			self.mouse_down = True
 		elif event.type == pygame.MOUSEBUTTONUP:
 			self.mouse_down = False
+			self.end_edit()
 		elif event.type == pygame.KEYDOWN:
 			if self.typing:
 				character = pygame.key.name(event.key)
@@ -590,27 +916,77 @@ class Game:
 					self.options[self.option_index].previous_option()
 			else:
 				character = pygame.key.name(event.key)
-				if character == "w" or character == "a" or character == "s" or character == "d":
-					if character == "w":
-						self.offset.y -= 1
-					elif character == "a":
-						self.offset.x -= 1
-					elif character == "s":
-						self.offset.y += 1
-					elif character == "d":
-						self.offset.x += 1
-				for keybind in self.keybinds:
-					if keybind.key.lower() == character.lower():
-						keybind.activate()
-			if event.key == pygame.K_b:
-				self.tool = "brush"
-			elif event.key == pygame.K_g:
-				self.tool = "bucket"
+				if event.mod & pygame.KMOD_CTRL:
+					self.manage_shortcut(character)
+				else:
+					if character == "w" or character == "a" or character == "s" or character == "d":
+						if character == "w":
+							self.offset.y -= 1
+						elif character == "a":
+							self.offset.x -= 1
+						elif character == "s":
+							self.offset.y += 1
+						elif character == "d":
+							self.offset.x += 1
+					for keybind in self.keybinds:
+						if keybind.key.lower() == character.lower():
+							keybind.activate()
+			if event.key == pygame.K_F3:
+				self.show_profiler = not self.show_profiler
 		elif event.type == pygame.KEYUP:
 			character = pygame.key.name(event.key)
 			if "shift" in character:
 				self.shifting = False
 
+def build_level(layers, events):
+	json_file = {}
+	json_file["blocks"] = []
+	json_file["events"] = []
+	json_file["player position"] = {
+		"x": 0,
+		"y": 0
+	}
+	json_file["layers"] = []
+	for layer in layers:
+		json_file["layers"].append([])
+		for name, x, y, collidable in layer:
+			json_file["layers"][len(json_file["layers"]) - 1].append({
+				"name": name,
+				"position": {
+					"x": x,
+					"y": y
+				},
+				"collidable": collidable
+			})
+	for name, x, y, trigger_key, radius in events:
+		json_file["events"].append({
+			"name": name,
+			"position": {
+				"x": x,
+				"y": y
+			},
+			"trigger key": trigger_key,
+			"radius": radius
+		})
+	return json_file
+
+# A block's (name, collidable) pair, or None for an empty tile
+def get_state(block):
+	if block == False:
+		return None
+	return (block.name, block.collidable)
+
+def get_name(block):
+	if block == False:
+		return None
+	return block.name
+
+def set_state(layer, x, y, state):
+	if state == None:
+		layer.remove_block(x, y)
+	else:
+		layer.add_block(Block(state[0], Vector2(x, y), state[1]))
+
 def collides(x, y, r, b, x2, y2, r2, b2):
 	return not (r <= x2 or x > r2 or b <= y2 or y > b2);
 
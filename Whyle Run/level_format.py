@@ -0,0 +1,196 @@
+from array import array
+from hashlib import blake2b
+from mmap import mmap, ACCESS_READ
+from os import listdir, replace
+from os.path import getsize, isfile, splitext
+from sys import argv, byteorder
+import json
+import struct
+
+# Layout: header, tile name table, then for every layer a width * height grid of
+# little-endian uint16 tile ids (0 is empty, n is names[n - 1]) followed by one
+# collidable bit per cell, and finally the level's events as a JSON blob. The header ends with the size and
+# hash of the JSON file the level was converted from
+MAGIC = b"WRLV"
+VERSION = 2
+HEADER = struct.Struct("<4sHHHiiIIIQ16s")
+
+# Level files come in two shapes: the old single "blocks" list and the newer list of "layers"
+def read_json_layers(dictionary):
+	if "layers" in dictionary and len(dictionary["layers"]) > 0:
+		return dictionary["layers"]
+	return [dictionary.get("blocks", [])]
+
+# Greedily merges a set of (x, y) tiles into as few (x, y, width, height) rectangles as it can: each rectangle
+# starts at the topmost, leftmost tile still left, grows right as far as it can, then down while whole rows fit
+def merge_tiles(tiles):
+	remaining = set(tiles)
+	rectangles = []
+	for x, y in sorted(remaining, key=lambda tile: (tile[1], tile[0])):
+		if (x, y) not in remaining:
+			continue
+		width = 1
+		while (x + width, y) in remaining:
+			width += 1
+		height = 1
+		while all((x + i, y + height) in remaining for i in range(width)):
+			height += 1
+		for j in range(height):
+			for i in range(width):
+				remaining.discard((x + i, y + j))
+		rectangles.append((x, y, width, height))
+	return rectangles
+
+def binary_location(json_location):
+	return splitext(json_location)[0] + ".lvl"
+
+def hash_source(source):
+	return blake2b(source, digest_size=16).digest()
+
+# Returns True if the binary copy of a level exists and was converted from the JSON file as it is now.
+# Sizes are compared first, so most edits are caught without reading or hashing the JSON file
+def binary_is_current(json_location):
+	location = binary_location(json_location)
+	if not isfile(location):
+		return False
+	if not isfile(json_location):
+		return True
+	with open(location, "rb") as file:
+		header = file.read(HEADER.size)
+	if len(header) < HEADER.size:
+		return False
+	fields = HEADER.unpack(header)
+	if fields[0] != MAGIC or fields[1] != VERSION or getsize(json_location) != fields[9]:
+		return False
+	with open(json_location, "rb") as file:
+		source = file.read()
+	return hash_source(source) == fields[10]
+
+# Converts the level if its binary copy is missing or out of date and returns where the copy is, or None if it
+# couldn't be written, in which case the JSON file has to be read instead
+def update_binary(json_location):
+	if binary_is_current(json_location):
+		return binary_location(json_location)
+	if not isfile(json_location):
+		return None
+	try:
+		return convert(json_location)
+	except (OSError, struct.error) as error:
+		print(f"Could not convert {json_location}: {error}")
+		return None
+
+def convert(json_location, level_location=None):
+	if level_location == None:
+		level_location = binary_location(json_location)
+	with open(json_location, "rb") as file:
+		source = file.read()
+	dictionary = json.loads(source)
+	layers = read_json_layers(dictionary)
+	blocks = [block for layer in layers for block in layer]
+	left = min([block["position"]["x"] for block in blocks], default=0)
+	top = min([block["position"]["y"] for block in blocks], default=0)
+	width = max([block["position"]["x"] + 1 for block in blocks], default=left) - left
+	height = max([block["position"]["y"] + 1 for block in blocks], default=top) - top
+	names = []
+	ids = {}
+	grids = []
+	for layer in layers:
+		tiles = array("H", bytes(width * height * 2))
+		bits = bytearray((width * height + 7) // 8)
+		for block in layer:
+			if block["name"] not in ids:
+				names.append(block["name"])
+				ids[block["name"]] = len(names)
+			index = (block["position"]["y"] - top) * width + block["position"]["x"] - left
+			tiles[index] = ids[block["name"]]
+			if block["collidable"]:
+				bits[index >> 3] |= 1 << (index & 7)
+			else:
+				bits[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+		if byteorder == "big":
+			tiles.byteswap()
+		grids.append((tiles, bits))
+	events = json.dumps(dictionary.get("events", [])).encode("utf-8")
+	with open(level_location + ".tmp", "wb") as file:
+		file.write(HEADER.pack(MAGIC, VERSION, len(layers), len(names), left, top, width, height, len(events), len(source), hash_source(source)))
+		for name in names:
+			encoded = name.encode("utf-8")
+			file.write(struct.pack("<B", len(encoded)))
+			file.write(encoded)
+		for tiles, bits in grids:
+			file.write(tiles.tobytes())
+			file.write(bits)
+		file.write(events)
+	replace(level_location + ".tmp", level_location)
+	return level_location
+
+# Writes through a temporary file and renames it over the old one, so a crash mid-save never leaves a truncated level
+def write_json(location, dictionary):
+	with open(location + ".tmp", "w") as file:
+		json.dump(dictionary, file, indent=4)
+	replace(location + ".tmp", location)
+
+# Reads a converted level through a read-only memory map; tiles are only decoded one chunk at a time
+class BinaryLevel:
+	def __init__(self, file_location, chunk_width, chunk_height):
+		self.chunk_width = chunk_width
+		self.chunk_height = chunk_height
+		with open(file_location, "rb") as file:
+			self.data = mmap(file.fileno(), 0, access=ACCESS_READ)
+		magic, version, self.layer_count, name_count, self.left, self.top, self.width, self.height, events_length = HEADER.unpack_from(self.data, 0)[:9]
+		if magic != MAGIC or version != VERSION:
+			raise ValueError(f"{file_location} is not a version {VERSION} level file")
+		offset = HEADER.size
+		self.names = []
+		for i in range(name_count):
+			length = self.data[offset]
+			self.names.append(self.data[offset + 1:offset + 1 + length].decode("utf-8"))
+			offset += 1 + length
+		cells = self.width * self.height
+		self.layer_offsets = []
+		for i in range(self.layer_count):
+			self.layer_offsets.append((offset, offset + cells * 2))
+			offset += cells * 2 + (cells + 7) // 8
+		self.events = json.loads(self.data[offset:offset + events_length].decode("utf-8"))
+		self.bounds = [self.left, self.top, self.left + self.width, self.top + self.height]
+		# Merged collision rectangles by chunk, so a chunk streamed in again doesn't merge its tiles again
+		self.colliders = {}
+
+	def has_chunk(self, key):
+		x = key[0] * self.chunk_width
+		y = key[1] * self.chunk_height
+		return x < self.bounds[2] and x + self.chunk_width > self.left and y < self.bounds[3] and y + self.chunk_height > self.top
+
+	# Yields (name, x, y, collidable) for every tile of a layer inside the given tile rectangle
+	def read_tiles(self, layer_index, left, top, right, bottom):
+		tiles_offset, bits_offset = self.layer_offsets[layer_index]
+		left = max(left, self.left) - self.left
+		right = min(right, self.left + self.width) - self.left
+		if right <= left:
+			return
+		for y in range(max(top, self.top) - self.top, min(bottom, self.top + self.height) - self.top):
+			row = y * self.width
+			tiles = array("H", self.data[tiles_offset + (row + left) * 2:tiles_offset + (row + right) * 2])
+			if byteorder == "big":
+				tiles.byteswap()
+			for x in range(left, right):
+				tile = tiles[x - left]
+				if tile != 0:
+					index = row + x
+					collidable = self.data[bits_offset + (index >> 3)] >> (index & 7) & 1 == 1
+					yield (self.names[tile - 1], x + self.left, y + self.top, collidable)
+
+	def read_chunk(self, key):
+		left = key[0] * self.chunk_width
+		top = key[1] * self.chunk_height
+		return [list(self.read_tiles(i, left, top, left + self.chunk_width, top + self.chunk_height)) for i in range(self.layer_count)]
+
+	def read_layer(self, layer_index):
+		return self.read_tiles(layer_index, self.left, self.top, self.left + self.width, self.top + self.height)
+
+if __name__ == "__main__":
+	files = argv[1:]
+	if len(files) == 0:
+		files = [f"./levels/{f}" for f in listdir("./levels/") if f.endswith(".json")]
+	for file in files:
+		print(f"{file} -> {convert(file)}")
@@ -1,10 +1,18 @@
 from subprocess import run
 from sys import executable
 from pkg_resources import working_set
-from time import time
+from time import time, perf_counter
+from threading import Thread
+from queue import Queue, Empty
 import json
 from os import listdir
 from os.path import isfile, join
+from asset_cache import AssetCache
+from asset_loader import AssetLoader, scale_sprite
+from level_format import BinaryLevel, merge_tiles, read_json_layers, update_binary
+from profiler import FrameProfiler
+from atlas import TextureAtlas
+from batch_physics import BatchPhysics, has_numpy
 
 
 print("Loading libraries. . . Please wait")
@@ -31,44 +39,370 @@ class Block:
 		self.collidable = collidable
 
 class Image:
-	def __init__(self, src, draw_width=64, draw_height=64):
+	# An image that was already loaded and scaled elsewhere can be passed in along with the sizes it was scaled to
+	def __init__(self, src, draw_width=64, draw_height=64, cache=None, image=None, sizes=None):
 		self.src = src
-		self.image = pygame.image.load(self.src).convert_alpha()
-		self.rescale(Vector2(draw_width, draw_height))
+		self.cache = cache
+		self.sizes = []
+		self.image = None
+		self.variants = {}
+		self.regions = {}
+		if image != None:
+			self.image = image
+			self.sizes = list(sizes)
+			self.dimensions = Vector2(self.image.get_width(), self.image.get_height())
+		else:
+			self.rescale(Vector2(draw_width, draw_height))
 		self.image_rect = self.image.get_rect()
 		self.dimensions = Vector2(self.image.get_width(), self.image.get_height())
 
+	# Every rescale works from the previous result, so cache entries are keyed by the whole chain of sizes
 	def rescale(self, new_dimensions):
-		if self.image.get_width() != self.image.get_height():
-			x = new_dimensions.x
-			y = x
-			new_dimensions = Vector2(int(new_dimensions.x), int(round(new_dimensions.x / self.image.get_width() * self.image.get_height())))
-		self.image = pygame.transform.scale(self.image, (new_dimensions.x, new_dimensions.y)).convert_alpha()
+		self.sizes.append((new_dimensions.x, new_dimensions.y))
+		cached = None
+		if self.cache != None:
+			cached = self.cache.load(self.src, self.sizes)
+		if cached != None:
+			self.image = cached
+		else:
+			if self.image == None:
+				self.image = pygame.image.load(self.src).convert_alpha()
+			self.image = scale_sprite(self.image, (new_dimensions.x, new_dimensions.y)).convert_alpha()
+			if self.cache != None:
+				self.cache.save(self.src, self.sizes, self.image)
 		self.dimensions = Vector2(self.image.get_width(), self.image.get_height())
-
-	def draw(self, screen, position, flip=False):
-		if flip:
-			screen.blit(pygame.transform.flip(self.image, True, False), (position.x, position.y))
+		self.variants = {}
+		self.regions = {}
+
+	# Returns the image flipped, scaled and/or rotated, creating each variant once and reusing it afterwards
+	def get_variant(self, flip=False, scale=1, angle=0):
+		key = (flip, scale, angle)
+		if key not in self.variants:
+			image = self.image
+			if scale != 1:
+				image = pygame.transform.scale(image, (int(round(self.dimensions.x * scale)), int(round(self.dimensions.y * scale))))
+			if flip:
+				image = pygame.transform.flip(image, True, False)
+			if angle != 0:
+				image = pygame.transform.rotate(image, angle)
+			self.variants[key] = image.convert_alpha()
+		return self.variants[key]
+
+	def get_surfaces(self):
+		surfaces = {(False, 1, 0): self.image}
+		surfaces.update(self.variants)
+		return surfaces
+
+	# Draws from the atlas from now on, for every variant that existed when the atlas was built
+	def use_atlas(self, atlas, name):
+		self.regions = {}
+		for key in self.get_surfaces():
+			if atlas.has_region((name,) + key):
+				self.regions[key] = atlas.get_region((name,) + key)
+
+	def draw(self, screen, position, flip=False, scale=1, angle=0):
+		key = (flip, scale, angle)
+		if key in self.regions:
+			surface, area = self.regions[key]
+			return screen.blit(surface, (position.x, position.y), area)
+		elif flip or scale != 1 or angle != 0:
+			return screen.blit(self.get_variant(flip, scale, angle), (position.x, position.y))
 		else:
-			screen.blit(self.image, (position.x, position.y))
+			return screen.blit(self.image, (position.x, position.y))
 
 class Layer:
 	def __init__(self, name, layer_index):
 		self.name = name
 		self.layer_index = layer_index
 		self.blocks = []
+		self.surface = None
+		self.origin = Vector2()
 	def add_block(self, block):
 		self.blocks.append(block)
 
+	# Pre-renders every block into one surface so the layer can be drawn with a single blit
+	def bake(self, block_types, square_size):
+		self.surface = None
+		if len(self.blocks) == 0:
+			return
+		left = min(block.position.x for block in self.blocks)
+		top = min(block.position.y for block in self.blocks)
+		width = 0
+		height = 0
+		for block in self.blocks:
+			dimensions = block_types[block.name].dimensions
+			width = max(width, (block.position.x - left) * square_size + dimensions.x)
+			height = max(height, (block.position.y - top) * square_size + dimensions.y)
+		self.origin = Vector2(left * square_size, top * square_size)
+		self.surface = pygame.Surface((int(width), int(height)), pygame.SRCALPHA).convert_alpha()
+		for block in self.blocks:
+			block_types[block.name].draw(self.surface, Vector2((block.position.x - left) * square_size, (block.position.y - top) * square_size))
+
+	# The blit is clipped to the screen, so only the part of the layer inside the camera is drawn
+	def draw(self, screen, camera):
+		if self.surface != None:
+			screen.blit(self.surface, (self.origin.x - camera.position.x, self.origin.y - camera.position.y))
+
+class Camera:
+	def __init__(self, width=0, height=0, margin=64):
+		self.position = Vector2()
+		self.dimensions = Vector2(width, height)
+		self.margin = margin
+		self.bounds = [0, 0, 0, 0]
+
+	# Limits scrolling to the level's tile bounds, always including the origin
+	def fit(self, bounds, square_size):
+		self.bounds = [min(0, bounds[0] * square_size), min(0, bounds[1] * square_size), max(0, bounds[2] * square_size), max(0, bounds[3] * square_size)]
+
+	def follow(self, position, dimensions):
+		x = position.x + dimensions.x * 0.5 - self.dimensions.x * 0.5
+		y = position.y + dimensions.y * 0.5 - self.dimensions.y * 0.5
+		self.position.x = int(max(self.bounds[0], min(x, self.bounds[2] - self.dimensions.x)))
+		self.position.y = int(max(self.bounds[1], min(y, self.bounds[3] - self.dimensions.y)))
+
+	def to_screen(self, position):
+		return Vector2(position.x - self.position.x, position.y - self.position.y)
+
+	# Returns True if the box is inside the view, grown by the margin on every side
+	def visible(self, position, dimensions):
+		return box_collides(Vector2(self.position.x - self.margin, self.position.y - self.margin), position, Vector2(self.dimensions.x + self.margin * 2, self.dimensions.y + self.margin * 2), dimensions)
+
+# Holds static colliders, (x, y, width, height) rectangles in tiles, listed under every tile they cover
+class CollisionGrid:
+	def __init__(self):
+		self.cells = {}
+		self.version = 0
+
+	def add_colliders(self, colliders):
+		self.version += 1
+		for collider in colliders:
+			for key in get_tiles(collider):
+				if key in self.cells:
+					self.cells[key].append(collider)
+				else:
+					self.cells[key] = [collider]
+
+	def remove_colliders(self, colliders):
+		self.version += 1
+		for collider in colliders:
+			for key in get_tiles(collider):
+				if key in self.cells and collider in self.cells[key]:
+					self.cells[key].remove(collider)
+					if len(self.cells[key]) == 0:
+						del self.cells[key]
+
+	# Returns each collider touching a tile the box overlaps, padded by one tile on each side, once
+	def query(self, position, dimensions, square_size):
+		left = int(position.x // square_size) - 1
+		top = int(position.y // square_size) - 1
+		right = int((position.x + dimensions.x) // square_size) + 1
+		bottom = int((position.y + dimensions.y) // square_size) + 1
+		colliders = {}
+		for y in range(top, bottom + 1):
+			for x in range(left, right + 1):
+				if (x, y) in self.cells:
+					for collider in self.cells[(x, y)]:
+						colliders[collider] = True
+		return list(colliders)
+
+class Chunk:
+	def __init__(self, key, layers, colliders):
+		self.key = key
+		self.layers = layers
+		self.colliders = colliders
+		self.baked_size = None
+
+	def bake(self, block_types, square_size, size):
+		for layer in self.layers:
+			layer.bake(block_types, square_size)
+		self.baked_size = size
+
+# Reads a level file and buckets its tiles by chunk, so Blocks are only built for chunks that get loaded
+class JsonLevel:
+	def __init__(self, file_location, chunk_width, chunk_height):
+		with open(file_location, "r") as file:
+			dictionary = json.load(file)
+		self.events = dictionary.get("events", [])
+		layers = read_json_layers(dictionary)
+		self.layer_count = len(layers)
+		self.chunks = {}
+		# Merged collision rectangles by chunk, so a chunk streamed in again doesn't merge its tiles again
+		self.colliders = {}
+		self.bounds = [0, 0, 0, 0]
+		for i in range(self.layer_count):
+			for block in layers[i]:
+				x = block["position"]["x"]
+				y = block["position"]["y"]
+				key = (x // chunk_width, y // chunk_height)
+				if key not in self.chunks:
+					self.chunks[key] = [[] for layer in range(self.layer_count)]
+				self.chunks[key][i].append((block["name"], x, y, block["collidable"]))
+				self.bounds = [min(self.bounds[0], x), min(self.bounds[1], y), max(self.bounds[2], x + 1), max(self.bounds[3], y + 1)]
+
+	def has_chunk(self, key):
+		return key in self.chunks
+
+	def read_chunk(self, key):
+		return self.chunks[key]
+
+# Keeps only the chunks around the camera in memory, building and baking new ones on a background thread
+class ChunkStreamer:
+	def __init__(self, chunk_width, chunk_height, threaded=True):
+		self.chunk_width = chunk_width
+		self.chunk_height = chunk_height
+		self.threaded = threaded
+		self.level = None
+		self.chunks = {}
+		self.pending = set()
+		self.generation = 0
+		self.version = 0
+		self.requests = Queue()
+		self.results = Queue()
+		self.worker = None
+
+	# The chunks passed in must already be in the collision grid used with this level
+	def open(self, level, chunks):
+		self.generation += 1
+		self.level = level
+		self.chunks = dict(chunks)
+		self.pending = set()
+		self.version += 1
+
+	# The collidable tiles of every layer are merged into rectangles that stay within the chunk
+	def build_chunk(self, level, key):
+		layers = []
+		solid = set()
+		for i, tiles in enumerate(level.read_chunk(key)):
+			layer = Layer("", i)
+			for name, x, y, collidable in tiles:
+				layer.add_block(Block(name, Vector2(x, y), collidable))
+				if collidable:
+					solid.add((x, y))
+			layers.append(layer)
+		if key not in level.colliders:
+			level.colliders[key] = merge_tiles(solid)
+		return Chunk(key, layers, level.colliders[key])
+
+	# Baking here rather than when the chunk is first drawn keeps the surfaces and blits off the frame that shows it
+	def prepare_chunk(self, level, key, block_types, square_size, size):
+		chunk = self.build_chunk(level, key)
+		chunk.bake(block_types, square_size, size)
+		return chunk
+
+	# Errors are passed back to the main thread, which would otherwise wait forever for a chunk in view
+	def work(self):
+		while True:
+			generation, level, key, block_types, square_size, size = self.requests.get()
+			try:
+				self.results.put((generation, key, self.prepare_chunk(level, key, block_types, square_size, size)))
+			except Exception as error:
+				self.results.put((generation, key, error))
+
+	def receive(self, result, collision_grid):
+		generation, key, chunk = result
+		if generation != self.generation:
+			return
+		self.pending.discard(key)
+		if isinstance(chunk, Exception):
+			raise chunk
+		self.add_chunk(chunk, collision_grid)
+
+	# Returns the keys of every chunk overlapping the camera's view, grown by margin chunks on each side
+	def chunk_range(self, camera, square_size, margin):
+		chunk_width = self.chunk_width * square_size
+		chunk_height = self.chunk_height * square_size
+		left = int(camera.position.x // chunk_width) - margin
+		top = int(camera.position.y // chunk_height) - margin
+		right = int((camera.position.x + camera.dimensions.x) // chunk_width) + margin
+		bottom = int((camera.position.y + camera.dimensions.y) // chunk_height) + margin
+		return [(x, y) for y in range(top, bottom + 1) for x in range(left, right + 1)]
+
+	def add_chunk(self, chunk, collision_grid):
+		if chunk.key not in self.chunks:
+			self.chunks[chunk.key] = chunk
+			self.version += 1
+			collision_grid.add_colliders(chunk.colliders)
+
+	# Every missing chunk is requested from the worker, and the frame only waits for the ones already in view
+	def update(self, camera, square_size, collision_grid, block_types, size, wait=False):
+		while True:
+			try:
+				result = self.results.get_nowait()
+			except Empty:
+				break
+			self.receive(result, collision_grid)
+		kept = self.chunk_range(camera, square_size, 2)
+		for key in list(self.chunks):
+			if key not in kept:
+				collision_grid.remove_colliders(self.chunks[key].colliders)
+				del self.chunks[key]
+				self.version += 1
+		visible = self.chunk_range(camera, square_size, 0)
+		for key in self.chunk_range(camera, square_size, 1):
+			if key in self.chunks or not self.level.has_chunk(key):
+				continue
+			if wait or not self.threaded:
+				self.add_chunk(self.prepare_chunk(self.level, key, block_types, square_size, size), collision_grid)
+			elif key not in self.pending:
+				if self.worker == None:
+					self.worker = Thread(target=self.work, daemon=True)
+					self.worker.start()
+				self.pending.add(key)
+				self.requests.put((self.generation, self.level, key, block_types, square_size, size))
+		while any(key in self.pending for key in visible):
+			self.receive(self.results.get(), collision_grid)
+
+# A trigger placed in the level designer; radius is in tiles around the centre of the event's tile
+class Event:
+	def __init__(self, name, position, radius, trigger_key):
+		self.name = name
+		self.position = position
+		self.radius = float(radius)
+		self.trigger_key = trigger_key.lower()
+
+	def contains(self, x, y):
+		dx = x - (self.position.x + 0.5)
+		dy = y - (self.position.y + 0.5)
+		return dx * dx + dy * dy <= self.radius * self.radius
+
+# Lists every event under each cell its trigger circle's bounding box overlaps, so finding the events that
+# could contain a point only looks at one cell
+class EventGrid:
+	def __init__(self, cell_size=8):
+		self.cell_size = cell_size
+		self.cells = {}
+
+	def add(self, event):
+		left = int((event.position.x + 0.5 - event.radius) // self.cell_size)
+		top = int((event.position.y + 0.5 - event.radius) // self.cell_size)
+		right = int((event.position.x + 0.5 + event.radius) // self.cell_size)
+		bottom = int((event.position.y + 0.5 + event.radius) // self.cell_size)
+		for y in range(top, bottom + 1):
+			for x in range(left, right + 1):
+				if (x, y) in self.cells:
+					self.cells[(x, y)].append(event)
+				else:
+					self.cells[(x, y)] = [event]
+
+	def query(self, x, y):
+		return self.cells.get((int(x // self.cell_size), int(y // self.cell_size)), [])
+
+class PreparedLevel:
+	def __init__(self, level, chunks, collision_grid):
+		self.level = level
+		self.chunks = chunks
+		self.collision_grid = collision_grid
+
 class Component:
 	def __init__(self, name):
 		self.name = name
 
 class Rigidbody(Component):
-	def __init__(self, mass=360, velocity=Vector2()):
+	def __init__(self, mass=360, velocity=None):
 		super().__init__("rigidbody")
 		self.mass = mass
-		self.velocity = velocity
+		# A default Vector2() argument would be one velocity shared by every rigidbody
+		self.velocity = velocity if velocity != None else Vector2()
 		self.grounded = False
 
 class Animation:
@@ -81,7 +415,7 @@ class Animator(Component):
 		super().__init__("animator")
 		self.animations = animations
 		self.frame_time = frame_time
-		self.last_frame = time()
+		self.elapsed = 0
 		self.frame_index = 0
 		self.animation = self.animations[1]
 
@@ -94,14 +428,15 @@ class Animator(Component):
 		for animation in self.animations:
 			if animation.name == name:
 				if name != self.animation.name:
-					self.last_frame = time()
+					self.elapsed = 0
 					self.animation = animation
 					self.frame_index = 0
 
-	def update(self):
-		if time() - self.last_frame >= self.frame_time:
+	def update(self, delta_time):
+		self.elapsed += delta_time
+		if self.elapsed >= self.frame_time:
 			self.next_frame()
-			self.last_frame = time()
+			self.elapsed = 0
 
 	def get_frame(self):
 		return self.animation.frames[self.frame_index]
@@ -111,23 +446,41 @@ class GameObject:
 		self.name = name
 		self.position = position
 		self.image_name = image_name
+		self.previous_position = Vector2(position.x, position.y)
 		self.dimensions = Vector2(20, 32)
-		self.components = []
+		self.components = {}
+		# Each component type has its own attribute, so systems reach it without searching by name
+		self.rigidbody = None
+		self.animator = None
 		self.flip = False
 
 	def add_component(self, component):
-		self.components.append(component)
+		self.components[component.name] = component
+		setattr(self, component.name, component)
+
+	# Blends the positions before and after the last physics step, alpha being how far into the next step rendering is
+	def interpolate(self, alpha):
+		return Vector2(self.previous_position.x + (self.position.x - self.previous_position.x) * alpha, self.previous_position.y + (self.position.y - self.previous_position.y) * alpha)
 
 	def get_component(self, component_name):
-		for component in self.components:
-			if component.name == component_name:
-				return component
-		return False
+		return self.components.get(component_name, False)
 
 class Game:
 	def __init__(self):
 		self.fps_cap = 165
-		self.times = []
+		self.profiler = FrameProfiler(["input", "physics", "tiles", "ui", "flip"])
+		self.show_profiler = False
+		self.dirty_rendering = False
+		self.background = None
+		self.background_key = None
+		self.dirty_rects = []
+		self.full_redraw = True
+		self.render_scale = 1
+		self.scale_filter = "fast"
+		self.canvas = None
+		self.preload_thread = None
+		self.preload_result = []
+		self.preload_name = ""
 		self.player = GameObject("Player", Vector2(), "whyle")
 		walk = Animation("whyle walk", ["whyle","whyle1","whyle","whyle2"])
 		idle = Animation("whyle idle", ["whyle"])
@@ -137,156 +490,344 @@ class Game:
 		self.tested_resolution = 0
 		self.delta_time = 0
 		self.block_types = {}
+		self.atlas = TextureAtlas()
 		self.blocks = []
 		self.square_width = 32
 		self.square_height = int(round(self.square_width / 1.777))
 		self.level_background_color = (135, 206, 235)
 		self.keys = {}
 		self.game_objects = []
+		# The game objects that have each type of component, so every system only visits the objects it acts on
+		self.systems = {"rigidbody": [], "animator": []}
+		# Steps every rigidbody except the player's together when set up with enable_batch_physics
+		self.batch_physics = None
 		self.resize_names = ["whyle", "whyle1", "whyle2", "whyle_jump"]
 		self.loading = False
 		self.unloading = False
 		self.load_time = 1
 		self.to_load = ""
 		self.loaded = False
-		self.layers = []
+		self.layer_count = 0
+		self.collision_grid = CollisionGrid()
+		self.camera = Camera()
+		self.streamer = ChunkStreamer(self.square_width, self.square_height)
+		self.tick_rate = 120
+		self.fixed_delta = 1 / self.tick_rate
+		self.max_steps = 8
+		self.accumulator = 0
+		self.interpolation = 0
+		self.deterministic = False
+		self.frame_count = 0
+		self.events = []
+		self.event_grid = EventGrid()
+		# Events the player was inside after the last step, and the keys pressed since the last frame
+		self.inside_events = set()
+		self.pressed_keys = set()
+		# The first word of an event's name picks its handler, the rest are passed as arguments, e.g. "load level2"
+		self.event_handlers = {"load": self.load_event}
 
 	def to_tuple(self, vector):
 		return (vector.x, vector.y)
 
+	# Components have to be added before the game object, since that's when it is registered with the systems
 	def add_game_object(self, game_object):
 		self.game_objects.append(game_object)
+		for name in game_object.components:
+			if name == "rigidbody" and self.batch_physics != None and game_object is not self.player:
+				self.batch_physics.add(game_object)
+			else:
+				self.systems.setdefault(name, []).append(game_object)
+
+	def remove_game_object(self, game_object):
+		self.game_objects.remove(game_object)
+		for game_objects in self.systems.values():
+			if game_object in game_objects:
+				game_objects.remove(game_object)
+		if self.batch_physics != None:
+			self.batch_physics.remove(game_object)
+
+	# Has to be called before adding the game objects it should step; returns False if NumPy isn't installed
+	def enable_batch_physics(self):
+		if not has_numpy:
+			print("NumPy is not installed, every rigidbody uses the per-object physics")
+			return False
+		self.batch_physics = BatchPhysics()
+		return True
 
 	def add_vector(self, vector, vector1):
 		return Vector(vector.x + vector1.x, vector.y + vector1.y)
 
 	def draw_text(self, text="", position=Vector2(), color=(0,0,0), center=False, text_shadow=True):
 		text_surface = self.font.render(text, True, color)
-		self.screen.blit(text_surface, self.to_tuple(position))
+		return self.screen.blit(text_surface, self.to_tuple(position))
 
 	def load_images(self):
+		self.asset_cache = AssetCache()
+		self.asset_loader = AssetLoader(self.asset_cache)
 		files = [f for f in listdir("./images/") if isfile(join("./images/", f))]
+		jobs = {}
 		for file in files:
 			if ".png" in file:
-				self.block_types[file.split(".")[0]] = Image(f"./images/{file}", self.square_size, self.square_size)
+				sizes = [(self.square_size, self.square_size)]
+				if file.split(".")[0] in self.resize_names:
+					sizes.append((self.square_size * 1.25, 32))
+				jobs[file.split(".")[0]] = (f"./images/{file}", sizes)
+		for name, surface in self.asset_loader.load(jobs).items():
+			self.block_types[name] = Image(jobs[name][0], cache=self.asset_cache, image=surface, sizes=jobs[name][1])
+		self.asset_loader.report()
 
 		for name in self.resize_names:
-			self.block_types[name].rescale(Vector2(self.square_size * 1.25, 32))
+			self.block_types[name].get_variant(True)
 			#self.block_types[name].rescale(Vector2(self.square_size * 2.85, 32))
+		self.build_atlas()
+
+	def build_atlas(self):
+		surfaces = {}
+		for name, image in self.block_types.items():
+			for key, surface in image.get_surfaces().items():
+				surfaces[(name,) + key] = surface
+		self.atlas.build(surfaces)
+		for name, image in self.block_types.items():
+			image.use_atlas(self.atlas, name)
 
 	def start(self):
+		self.setup()
+		while self.run_frame():
+			pass
+
+	def setup(self):
 		pygame.init()
 		self.add_game_object(self.player)
 		self.font = pygame.font.SysFont("Arial", 30)
 		self.clock = pygame.time.Clock()
-		self.screen_height = int(pygame.display.Info().current_h * 0.75)
-		self.screen_width = int(pygame.display.Info().current_w * 0.75)
+		self.window_height = int(pygame.display.Info().current_h * 0.75)
+		self.window_width = int(pygame.display.Info().current_w * 0.75)
+		# The game is laid out and drawn at this fixed resolution whatever size the window is later given
+		self.screen_height = int(self.window_height * self.render_scale)
+		self.screen_width = int(self.window_width * self.render_scale)
 		self.flags = pygame.DOUBLEBUF | pygame.RESIZABLE
-		self.screen = pygame.display.set_mode((self.screen_width, self.screen_height), self.flags)
+		self.window = pygame.display.set_mode((self.window_width, self.window_height), self.flags)
+		self.update_render_target()
+		self.fade_surface = pygame.Surface((self.screen_width, self.screen_height)).convert()
+		self.fade_surface.fill((0, 0, 0))
 		self.square_size = int(round(self.screen_width / self.square_width))
-		self.player.get_component("rigidbody").mass = self.screen_height
+		self.camera = Camera(self.screen_width, self.screen_height, self.square_size * 2)
+		self.player.rigidbody.mass = self.screen_height
 		self.load_images()
 		self.load("level1", False)
 		self.player.dimensions = Vector2(int(self.square_size * 0.666), self.square_size)
-		exit_loop = False
 		self.player.dimensions = self.block_types["whyle"].dimensions
-		while True:
-			self.manage_time()
+
+	# Runs one frame of the game loop, returning False once the window has been closed
+	def run_frame(self):
+		self.frame_count += 1
+		self.manage_time()
+		phase_start = perf_counter()
+		self.pressed_keys = set()
+		for event in pygame.event.get():
+			if event.type == pygame.QUIT:
+				return False
+			else:
+				self.manage_event(event)
+		phase_start = self.record_phase("input", phase_start)
+
+		if self.loading and self.now() - self.start_load_time > self.load_time:
+			self.loading = False
+		if not self.loading and not self.unloading:
+			self.simulate()
+			self.update_events()
+		phase_start = self.record_phase("physics", phase_start)
+
+		self.camera.follow(self.player.interpolate(self.interpolation), self.player.dimensions)
+		self.streamer.update(self.camera, self.square_size, self.collision_grid, self.block_types, self.get_bake_size())
+		if self.dirty_rendering:
+			self.restore_background()
+		else:
 			if not self.loaded:
 				self.screen.fill(self.level_background_color)
-			for event in pygame.event.get():
-				if event.type == pygame.QUIT:
-					exit_loop = True
-					break
-				else:
-					self.manage_event(event)
-			if exit_loop:
-				break
-
-			for layer in self.layers:
-				for block in layer.blocks:
-					self.block_types[block.name].draw(self.screen, Vector2(block.position.x * self.square_size, block.position.y * self.square_size))
-
-			if self.loaded:
-				self.loaded = False
-			if self.loading:
-				if time() - self.start_load_time > self.load_time:
-					self.loading = False
-				for game_object in self.game_objects:
-					self.update_components(game_object)
-					self.block_types[game_object.image_name].draw(self.screen, game_object.position, game_object.flip)
-
-				s = pygame.Surface((self.screen_width,self.screen_height))
-				s.set_alpha(256 - ((time() - self.start_load_time) / self.load_time) * 256)
-				s.fill((0,0,0))
-				self.screen.blit(s, (0,0))
-
-				pygame.display.flip()
-				continue
-			elif self.unloading:
-				if time() - self.start_load_time > self.load_time:
-					self.unloading = False
-					self.loaded = True
-					self.load(self.to_load, False)
-				s = pygame.Surface((self.screen_width,self.screen_height))
-				s.set_alpha(((time() - self.start_load_time) / self.load_time) * 256)
-				s.fill((0,0,0))
-				self.screen.blit(s, (0,0))
-				pygame.display.flip()
-				continue
+			self.draw_layers(self.screen)
+		phase_start = self.record_phase("tiles", phase_start)
+
+		rects = []
+		if self.loaded:
+			self.loaded = False
+		if self.loading:
+			rects += self.draw_game_objects()
+
+			self.fade_surface.set_alpha(256 - ((self.now() - self.start_load_time) / self.load_time) * 256)
+			rects.append(self.screen.blit(self.fade_surface, (0,0)))
+		elif self.unloading:
+			# Stays faded out past load_time if the next level is somehow still being prepared
+			if self.now() - self.start_load_time > self.load_time and (self.preload_thread is None or not self.preload_thread.is_alive()):
+				self.unloading = False
+				self.loaded = True
+				self.load(self.to_load, False)
+			self.fade_surface.set_alpha(((self.now() - self.start_load_time) / self.load_time) * 256)
+			rects.append(self.screen.blit(self.fade_surface, (0,0)))
+		else:
+			rects += self.draw_game_objects()
+			rects.append(self.draw_text(f"FPS: {self.profiler.fps()}", Vector2(0, 0), (45, 255, 0)))
+		if self.show_profiler:
+			rects.append(self.profiler.draw(self.screen, Vector2(0, 40)))
+		phase_start = self.record_phase("ui", phase_start)
+		self.present(rects)
+		self.record_phase("flip", phase_start)
+		if not self.deterministic:
+			self.clock.tick(self.fps_cap)
+		return True
+
+	# Advances physics in fixed steps of fixed_delta seconds; the deterministic mode takes exactly one step per frame
+	def simulate(self):
+		if self.deterministic:
+			self.accumulator = self.fixed_delta
+		else:
+			self.accumulator = min(self.accumulator + self.delta_time, self.fixed_delta * self.max_steps)
+		while self.accumulator >= self.fixed_delta:
+			for game_object in self.systems["rigidbody"]:
+				game_object.previous_position = Vector2(game_object.position.x, game_object.position.y)
+			self.control_player()
+			self.update_game_objects()
+			if self.batch_physics != None:
+				self.batch_physics.step(self.fixed_delta, self.square_size, self.collision_grid, self.camera)
+			self.accumulator -= self.fixed_delta
+		if self.batch_physics != None:
+			self.batch_physics.write_back()
+		self.interpolation = self.accumulator / self.fixed_delta
+
+	# Wall-clock time, except in deterministic mode where every frame lasts exactly one physics step
+	def now(self):
+		if self.deterministic:
+			return self.frame_count * self.fixed_delta
+		return time()
+
+	def control_player(self):
+		rigidbody = self.player.rigidbody
+		animator = self.player.animator
+		x_movement = 0
+		if self.key_down("a"):
+			self.player.flip = True
+			x_movement -= 1
+		if self.key_down("d"):
+			self.player.flip = False
+			x_movement += 1
+		if x_movement != 0 and rigidbody.grounded:
+			animator.set_animation("whyle walk")
+		elif not rigidbody.grounded:
+			animator.set_animation("whyle jump")
+		else:
+			animator.set_animation("whyle idle")
+		add_x = x_movement * rigidbody.mass * 0.1 * self.fixed_delta
+		rigidbody.velocity.x = add_x
+		if self.key_down("w") and rigidbody.grounded:
+			rigidbody.velocity.y = -self.square_size * 10
+
+	# Stores how long a stage of the frame took, and returns the start time of the next stage
+	def record_phase(self, name, phase_start):
+		now = perf_counter()
+		self.profiler.record(name, now - phase_start)
+		return now
+
+	# Chunks baked for another screen size are baked again before they are drawn
+	def get_bake_size(self):
+		return (self.screen.get_width(), self.screen.get_height(), self.square_size)
+
+	def draw_layers(self, surface):
+		size = self.get_bake_size()
+		chunks = list(self.streamer.chunks.values())
+		for chunk in chunks:
+			if chunk.baked_size != size:
+				chunk.bake(self.block_types, self.square_size, size)
+		for i in range(self.layer_count):
+			for chunk in chunks:
+				chunk.layers[i].draw(surface, self.camera)
+
+	# Dirty rectangle mode keeps the sky and tiles in view in one surface, rebuilt only when the camera,
+	# the loaded chunks or the window change, and each frame copies it back over what was drawn last frame
+	def restore_background(self):
+		key = (self.camera.position.x, self.camera.position.y, self.streamer.version, self.screen.get_size(), self.square_size)
+		if self.background == None or self.background.get_size() != self.screen.get_size():
+			self.background = pygame.Surface(self.screen.get_size()).convert()
+			self.background_key = None
+		if self.background_key != key:
+			self.background.fill(self.level_background_color)
+			self.draw_layers(self.background)
+			self.background_key = key
+			self.screen.blit(self.background, (0, 0))
+			self.full_redraw = True
+		else:
+			for rect in self.dirty_rects:
+				self.screen.blit(self.background, rect, rect)
 
-			rigidbody = self.player.get_component("rigidbody")
-			animator = self.player.get_component("animator")
-			x_movement = 0
-			if self.key_down("a"):
-				self.player.flip = True
-				x_movement -= 1
-			if self.key_down("d"):
-				self.player.flip = False
-				x_movement += 1
-			if x_movement != 0 and rigidbody.grounded:
-				animator.set_animation("whyle walk")
-			elif not rigidbody.grounded:
-				animator.set_animation("whyle jump")
+	# Draws straight into the window while it matches the internal resolution, otherwise into a canvas that is scaled to the window once per frame
+	def update_render_target(self):
+		if self.window.get_size() == (self.screen_width, self.screen_height):
+			self.screen = self.window
+		else:
+			if self.canvas == None:
+				self.canvas = pygame.Surface((self.screen_width, self.screen_height)).convert()
+			self.screen = self.canvas
+		self.background_key = None
+		self.full_redraw = True
+
+	# Pushes only the areas drawn this frame and last frame to the display, unless everything was redrawn or has to be scaled
+	def present(self, rects):
+		if self.screen is not self.window:
+			if self.scale_filter == "smooth":
+				pygame.transform.smoothscale(self.screen, self.window.get_size(), self.window)
 			else:
-				animator.set_animation("whyle idle")
-			add_x = x_movement * rigidbody.mass * 0.1 * self.delta_time
-			rigidbody.velocity.x = add_x
-			if self.key_down("w") and rigidbody.grounded:
-				rigidbody.velocity.y = -self.square_size * 10
-			for game_object in self.game_objects:
-				self.update_components(game_object)
-				self.block_types[game_object.image_name].draw(self.screen, game_object.position, game_object.flip)
-
-			self.draw_text(f"FPS: {len(self.times)}", Vector2(0, 0), (45, 255, 0))
+				pygame.transform.scale(self.screen, self.window.get_size(), self.window)
+			pygame.display.flip()
+		elif not self.dirty_rendering or self.full_redraw:
 			pygame.display.flip()
-			#self.clock.tick(self.fps_cap)
-
-	def update_components(self, game_object):
-		if game_object.get_component("rigidbody"):
-			rb = game_object.get_component("rigidbody")
-			rb.velocity.y += rb.mass * self.delta_time
-			rb.grounded = False
-			game_object.position.y += rb.velocity.y * self.delta_time
-			for layer in self.layers:
-				for block in layer.blocks:
-					if block.collidable:
-						if box_collides(Vector2(block.position.x * self.square_size, block.position.y * self.square_size), self.player.position, Vector2(self.square_size, self.square_size), game_object.dimensions):
-							game_object.position.y = block.position.y * self.square_size - game_object.dimensions.y
-							rb.velocity.y = 0
-							rb.grounded = True
-						if box_collides(Vector2(block.position.x * self.square_size, block.position.y * self.square_size + 0.1), Vector2(self.player.position.x + rb.velocity.x, self.player.position.y), Vector2(self.square_size, self.square_size), self.player.dimensions):
-							if not box_collides(Vector2(block.position.x * self.square_size, block.position.y * self.square_size), self.player.position, Vector2(self.square_size, self.square_size), self.player.dimensions):
-								if rb.velocity.x > 0:
-									game_object.position.x = block.position.x * self.square_size - self.player.dimensions.x - 0.01
-								else:
-									game_object.position.x = block.position.x * self.square_size + self.square_size
-								rb.velocity.x = 0
-			game_object.position.x += rb.velocity.x
-		if game_object.get_component("animator"):
-			anim = game_object.get_component("animator")
-			anim.update()
-			game_object.image_name = anim.get_frame()
+		else:
+			pygame.display.update(self.dirty_rects + rects)
+		self.dirty_rects = rects
+		self.full_redraw = False
+
+	# Objects outside the camera's view are neither simulated nor drawn, except the player it follows
+	def update_game_objects(self):
+		for game_object in self.systems["rigidbody"]:
+			if self.is_active(game_object):
+				self.update_rigidbody(game_object, game_object.rigidbody)
+		for game_object in self.systems["animator"]:
+			if self.is_active(game_object):
+				self.update_animator(game_object, game_object.animator)
+
+	def is_active(self, game_object):
+		return game_object is self.player or self.camera.visible(game_object.position, game_object.dimensions)
+
+	def draw_game_objects(self):
+		rects = []
+		for game_object in self.game_objects:
+			if self.is_active(game_object):
+				rects.append(self.block_types[game_object.image_name].draw(self.screen, self.camera.to_screen(game_object.interpolate(self.interpolation)), game_object.flip))
+		return rects
+
+	def update_rigidbody(self, game_object, rb):
+		rb.velocity.y += rb.mass * self.fixed_delta
+		rb.grounded = False
+		game_object.position.y += rb.velocity.y * self.fixed_delta
+		reach = abs(rb.velocity.x)
+		nearby = self.collision_grid.query(Vector2(game_object.position.x - reach, game_object.position.y), Vector2(game_object.dimensions.x + reach * 2, game_object.dimensions.y), self.square_size)
+		for left, top, width, height in nearby:
+			position = Vector2(left * self.square_size, top * self.square_size)
+			size = Vector2(width * self.square_size, height * self.square_size)
+			if box_collides(position, game_object.position, size, game_object.dimensions):
+				game_object.position.y = position.y - game_object.dimensions.y
+				rb.velocity.y = 0
+				rb.grounded = True
+			if box_collides(Vector2(position.x, position.y + 0.1), Vector2(game_object.position.x + rb.velocity.x, game_object.position.y), size, game_object.dimensions):
+				if not box_collides(position, game_object.position, size, game_object.dimensions):
+					if rb.velocity.x > 0:
+						game_object.position.x = position.x - game_object.dimensions.x - 0.01
+					else:
+						game_object.position.x = position.x + size.x
+					rb.velocity.x = 0
+		game_object.position.x += rb.velocity.x
+
+	def update_animator(self, game_object, anim):
+		anim.update(self.fixed_delta)
+		game_object.image_name = anim.get_frame()
 
 
 
@@ -301,26 +842,41 @@ class Game:
 			self.loading = False
 			self.unloading = True
 			self.to_load = level_name
-			self.start_load_time = time()
+			self.start_load_time = self.now()
+			self.preload(level_name)
 			return
+		if self.preload_name == level_name and self.preload_thread != None:
+			self.preload_thread.join()
+			prepared = self.preload_result[0]
+		else:
+			prepared = self.prepare_level(level_name)
+		self.preload_thread = None
+		self.preload_name = ""
+		# Loading straight away also cancels a fade out to another level
+		self.unloading = False
+		self.to_load = ""
+		if isinstance(prepared, Exception):
+			raise prepared
 		self.delta_time = 0
+		self.accumulator = 0
 		self.player.position.y = 0
 		self.player.position.x = 0
+		self.player.previous_position = Vector2()
 		self.loading = True
-		self.start_load_time = time()
-		file_location = f"./levels/{level_name}.json"
-		with open(file_location, "r") as file:
-			dictionary = json.load(file)
-			i = 0
-			for layer in dictionary["layers"]:
-				if len(self.layers) <= i:
-					self.layers.append(Layer("",1))
-				self.layers[i].blocks = []
-				for block in layer:
-					self.layers[i].add_block(Block(block["name"],Vector2(block["position"]["x"], block["position"]["y"]),block["collidable"]))
-				i += 1
-			for event in dictionary["events"]:
-				self.events.append(Event(event["name"],Vector2(event["position"]["x"], event["position"]["y"]),event["radius"],event["trigger key"]))
+		self.start_load_time = self.now()
+		level = prepared.level
+		self.events = []
+		self.event_grid = EventGrid()
+		self.inside_events = set()
+		for event in level.events:
+			self.events.append(Event(event["name"],Vector2(event["position"]["x"], event["position"]["y"]),event["radius"],event["trigger key"]))
+			self.event_grid.add(self.events[-1])
+		self.layer_count = level.layer_count
+		self.collision_grid = prepared.collision_grid
+		self.streamer.open(level, prepared.chunks)
+		self.camera.fit(level.bounds, self.square_size)
+		self.camera.follow(self.player.position, self.player.dimensions)
+		self.streamer.update(self.camera, self.square_size, self.collision_grid, self.block_types, self.get_bake_size(), True)
 
 		# file_location = f"./levels/{level_name}.json"
 		# with open(file_location, "r") as file:
@@ -329,23 +885,86 @@ class Game:
 		# 	for block in dictionary["blocks"]:
 		# 		self.blocks.append(Block(block["name"],Vector2(block["position"]["x"], block["position"]["y"]),block["collidable"]))
 
+	# Parses the level and builds and bakes the chunks around the spawn point while the fade out plays
+	def preload(self, level_name):
+		self.preload_name = level_name
+		self.preload_result = []
+		self.preload_thread = Thread(target=self.run_preload, args=(level_name, self.preload_result), daemon=True)
+		self.preload_thread.start()
+
+	# Each preload gets its own result list, so a superseded preload finishing late can't overwrite a newer one
+	def run_preload(self, level_name, result):
+		try:
+			result.append(self.prepare_level(level_name))
+		except Exception as error:
+			result.append(error)
+
+	def prepare_level(self, level_name):
+		file_location = f"./levels/{level_name}.json"
+		# The binary copy is made on the first load after the JSON file changes
+		level_location = update_binary(file_location)
+		if level_location != None:
+			level = BinaryLevel(level_location, self.square_width, self.square_height)
+		else:
+			level = JsonLevel(file_location, self.square_width, self.square_height)
+		camera = Camera(self.camera.dimensions.x, self.camera.dimensions.y)
+		camera.fit(level.bounds, self.square_size)
+		camera.follow(Vector2(), self.player.dimensions)
+		collision_grid = CollisionGrid()
+		chunks = {}
+		for key in self.streamer.chunk_range(camera, self.square_size, 1):
+			if level.has_chunk(key):
+				chunk = self.streamer.prepare_chunk(level, key, self.block_types, self.square_size, self.get_bake_size())
+				collision_grid.add_colliders(chunk.colliders)
+				chunks[key] = chunk
+		return PreparedLevel(level, chunks, collision_grid)
+
+	# Runs the events whose circle holds the centre of the player: on their trigger key, or as soon as the
+	# player walks in if they have none
+	def update_events(self):
+		x = (self.player.position.x + self.player.dimensions.x * 0.5) / self.square_size
+		y = (self.player.position.y + self.player.dimensions.y * 0.5) / self.square_size
+		inside = set()
+		for event in self.event_grid.query(x, y):
+			if event.contains(x, y):
+				inside.add(event)
+				if event.trigger_key in self.pressed_keys or (event.trigger_key == "" and event not in self.inside_events):
+					self.trigger_event(event)
+		self.inside_events = inside
+
+	def trigger_event(self, event):
+		words = event.name.split()
+		if len(words) > 0 and words[0] in self.event_handlers:
+			self.event_handlers[words[0]](*words[1:])
+		else:
+			print(f"No handler for the event \"{event.name}\"")
+
+	def load_event(self, level_name=""):
+		if not isfile(f"./levels/{level_name}.json") and not isfile(f"./levels/{level_name}.lvl"):
+			print(f"The event's level \"{level_name}\" doesn't exist")
+			return
+		if not self.unloading:
+			self.load(level_name)
+
 	def manage_time(self):
+		delta_time = self.profiler.tick(time())
 		if not self.loading:
-			if len(self.times) > 0:
-				self.delta_time = time() - self.times[len(self.times) - 1]
-		self.times.append(time())
-		while(time() - self.times[0] > 1):
-			self.times.pop(0)
+			self.delta_time = delta_time
 
 	def manage_event(self, event):
 		if event.type == pygame.VIDEORESIZE:
-			w = self.screen.get_width()
-			h = self.screen.get_height()
-			print("Resizing")
+			self.window = pygame.display.get_surface()
+			self.update_render_target()
 		elif event.type == pygame.KEYDOWN:
+			if event.key == pygame.K_F3:
+				self.show_profiler = not self.show_profiler
+			elif event.key == pygame.K_F4:
+				self.dirty_rendering = not self.dirty_rendering
+				self.background_key = None
 			character = pygame.key.name(event.key)
 			if character.isalpha():
 				self.keys[character] = True
+			self.pressed_keys.add(character)
 		elif event.type == pygame.KEYUP:
 			character = pygame.key.name(event.key)
 			if character.isalpha():
@@ -354,6 +973,10 @@ class Game:
 	def scale(self, value):
 		return value
 
+def get_tiles(collider):
+	x, y, width, height = collider
+	return [(x + i, y + j) for j in range(height) for i in range(width)]
+
 def collides(x, y, r, b, x2, y2, r2, b2):
 	return not (r <= x2 or x > r2 or b <= y2 or y > b2);
 
@@ -364,5 +987,6 @@ def box_collides(pos, pos2, size1, size2):
 		pos2.x, pos2.y,
 		pos2.x + size2.x, pos2.y + size2.y);
 
-game = Game()
-game.start()
\ No newline at end of file
+if __name__ == "__main__":
+	game = Game()
+	game.start()
\ No newline at end of file
@@ -0,0 +1,106 @@
+from array import array
+from collections import deque
+import pygame
+
+# Fixed-size buffer of the most recent samples; appending overwrites the oldest one instead of shifting a list
+class RingBuffer:
+	def __init__(self, size):
+		self.values = array("d", bytes(size * 8))
+		self.size = size
+		self.index = 0
+		self.count = 0
+
+	def append(self, value):
+		self.values[self.index] = value
+		self.index = (self.index + 1) % self.size
+		self.count = min(self.count + 1, self.size)
+
+	def latest(self, age=0):
+		return self.values[(self.index - 1 - age) % self.size]
+
+	# Returns the stored samples from oldest to newest
+	def get_values(self):
+		if self.count < self.size:
+			return self.values[:self.count].tolist()
+		return self.values[self.index:].tolist() + self.values[:self.index].tolist()
+
+	def percentile(self, fraction):
+		if self.count == 0:
+			return 0
+		ordered = sorted(self.get_values())
+		return ordered[min(self.count - 1, int(round(fraction * (self.count - 1))))]
+
+class FrameProfiler:
+	def __init__(self, stages, size=600):
+		self.stage_names = stages
+		self.stages = {name: RingBuffer(size) for name in stages}
+		self.frames = RingBuffer(size)
+		self.last_tick = None
+		# Timestamps of the ticks from the last second, oldest first, so the FPS doesn't need the whole buffer walked
+		self.recent_ticks = deque()
+		self.colors = [(45, 255, 0), (255, 200, 0), (0, 160, 255), (255, 80, 200), (255, 80, 40), (200, 200, 200)]
+		self.font = None
+		self.background = None
+		self.lines = []
+		self.refresh_rate = 30
+		self.ticks = 0
+
+	# Call once per frame; returns the seconds since the previous frame
+	def tick(self, now):
+		delta = 0
+		if self.last_tick != None:
+			delta = now - self.last_tick
+			self.frames.append(delta)
+		self.last_tick = now
+		self.recent_ticks.append(now)
+		while now - self.recent_ticks[0] > 1:
+			self.recent_ticks.popleft()
+		self.ticks += 1
+		return delta
+
+	def record(self, stage, seconds):
+		self.stages[stage].append(seconds)
+
+	# Counts the frames that finished within the last second
+	def fps(self):
+		return len(self.recent_ticks) - 1 if len(self.recent_ticks) > 0 else 0
+
+	def summary(self):
+		lines = []
+		for name in ["frame"] + self.stage_names:
+			buffer = self.frames if name == "frame" else self.stages[name]
+			lines.append(f"{name}: p50 {buffer.percentile(0.5) * 1000:.2f} p95 {buffer.percentile(0.95) * 1000:.2f} p99 {buffer.percentile(0.99) * 1000:.2f} ms")
+		return lines
+
+	# Draws each stage's time per frame stacked on top of the previous ones, with percentiles underneath
+	def draw(self, screen, position, width=320, height=120, milliseconds=33.3):
+		if self.font == None:
+			self.font = pygame.font.SysFont("Arial", 16)
+		size = (width, height + 20 * (len(self.stage_names) + 1))
+		if self.background == None or self.background.get_size() != size:
+			self.background = pygame.Surface(size)
+			self.background.set_alpha(180)
+			self.background.fill((0, 0, 0))
+		rect = screen.blit(self.background, (position.x, position.y))
+		scale = height / (milliseconds / 1000)
+		frames = min(width, self.stages[self.stage_names[0]].count)
+		totals = [0] * frames
+		for i in range(len(self.stage_names)):
+			buffer = self.stages[self.stage_names[i]]
+			points = []
+			for x in range(frames):
+				age = frames - 1 - x
+				if age < buffer.count:
+					totals[x] += buffer.latest(age)
+				points.append((position.x + x, position.y + height - min(height, totals[x] * scale)))
+			if len(points) > 1:
+				pygame.draw.lines(screen, self.colors[i % len(self.colors)], False, points)
+		# Frames reaching this line are slower than 60 FPS
+		target = position.y + height - scale / 60
+		pygame.draw.line(screen, (255, 255, 255), (position.x, target), (position.x + width, target))
+		if self.ticks % self.refresh_rate == 0 or len(self.lines) == 0:
+			self.lines = self.summary()
+		for i in range(len(self.lines)):
+			color = (255, 255, 255) if i == 0 else self.colors[(i - 1) % len(self.colors)]
+			screen.blit(self.font.render(self.lines[i], True, color), (position.x + 4, position.y + height + i * 20))
+		return rect